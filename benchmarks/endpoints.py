@@ -0,0 +1,153 @@
+"""
+Latency percentiles, throughput and SQL statements per request of the main endpoints, driven
+through the ASGI app in-process (startup hooks, middleware and all) on a freshly seeded database
+with Arabic student names, users and their state grants. Prints the results as JSON, --output
+also writes them to a file to keep as a baseline.
+
+    python -m benchmarks.endpoints --students 20000 --users 50 --requests 200 --concurrency 4
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import httpx
+from tortoise import Tortoise
+
+from benchmarks.permissions import StatementCounter
+from benchmarks.seed import FIRST_NAMES, seed
+from config import create_app
+from models.models import States, Students
+
+PASSWORD = 'password'
+
+
+def scenarios(state_ids: list, student_ids: list, users: int, rnd: random.Random) -> dict:
+    # endpoint -> a function returning the (method, url, keyword arguments) of the next request
+    def student_body():
+        return {"name": f'{rnd.choice(FIRST_NAMES)} {rnd.choice(FIRST_NAMES)} {rnd.choice(FIRST_NAMES)}',
+                "state_id": rnd.choice(state_ids), "branch_id": rnd.randint(1, 5), "total_amount": 1000,
+                "installments": [{"install_id": install_id, "amount": 250 if install_id == 1 else 0}
+                                 for install_id in (1, 2, 3, 4)]}
+
+    return {
+        "GET /students": lambda: ('GET', '/students', {}),
+        "GET /states/{id}/students": lambda: ('GET', f'/states/{rnd.choice(state_ids)}/students',
+                                              {"params": {"page": rnd.randint(1, 5), "number_of_students": 50}}),
+        "GET /states/{id}/students?search": lambda: ('GET', f'/states/{rnd.choice(state_ids)}/students',
+                                                     {"params": {"search": rnd.choice(FIRST_NAMES)[:3]}}),
+        "GET /users": lambda: ('GET', '/users', {}),
+        "POST /login": lambda: ('POST', '/login', {"json": {"username": f'user{rnd.randint(1, users)}',
+                                                            "password": PASSWORD}}),
+        "POST /students": lambda: ('POST', '/students', {"json": student_body()}),
+        "PATCH /students/{id}": lambda: ('PATCH', f'/students/{rnd.choice(student_ids)}',
+                                         {"json": {"note": f'note {rnd.random()}',
+                                                   "installments": [{"install_id": 2,
+                                                                     "amount": rnd.choice([0, 250])}]}}),
+    }
+
+
+def percentiles(samples: list) -> dict:
+    cuts = statistics.quantiles(samples, n=100, method='inclusive') if len(samples) > 1 else samples * 99
+    return {"p50_ms": round(cuts[49], 2), "p95_ms": round(cuts[94], 2), "p99_ms": round(cuts[98], 2),
+            "max_ms": round(max(samples), 2)}
+
+
+async def statements(client: httpx.AsyncClient, make_request, repeat: int) -> float:
+    # one request at a time, so every statement logged belongs to it
+    logger = logging.getLogger('tortoise.db_client')
+    counter = StatementCounter()
+    level, propagate = logger.level, logger.propagate
+    logger.addHandler(counter)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    try:
+        for _ in range(repeat):
+            method, url, kwargs = make_request()
+            await client.request(method, url, **kwargs)
+    finally:
+        logger.removeHandler(counter)
+        logger.setLevel(level)
+        logger.propagate = propagate
+    return round(counter.count / repeat, 1)
+
+
+async def measure(client: httpx.AsyncClient, make_request, requests: int, concurrency: int) -> dict:
+    samples = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            method, url, kwargs = make_request()
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            samples.append((time.perf_counter() - start) * 1000)
+            errors += response.status_code >= 400
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {"requests": requests, "errors": errors, **percentiles(samples),
+            "requests_per_second": round(requests / elapsed, 1)}
+
+
+async def run(args) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    await Tortoise.init(db_url=f'sqlite://{path}', modules={'models': ['models.models']})
+    await Tortoise.generate_schemas()
+    counts = await seed(states=args.states, students=args.students, installments=args.installments,
+                        users=args.users, password=PASSWORD, arabic_names=True)
+    await Tortoise.close_connections()
+
+    app = create_app(path)
+    # the startup hooks build the search index and the totals of the seeded rows
+    await app.router.startup()
+    try:
+        state_ids = await States.all().values_list('id', flat=True)
+        student_ids = await Students.all().values_list('id', flat=True)
+        rnd = random.Random(args.seed)
+        result = {"dataset": counts, "concurrency": args.concurrency, "endpoints": {}}
+        requests = {"GET /students": args.bulk_requests, "POST /login": args.login_requests}
+        async with httpx.AsyncClient(app=app, base_url='http://benchmark', timeout=None) as client:
+            for name, make_request in scenarios(state_ids, student_ids, args.users, rnd).items():
+                if args.endpoints and name not in args.endpoints:
+                    continue
+                count = requests.get(name, args.requests)
+                queries = await statements(client, make_request, min(count, 5))
+                result["endpoints"][name] = {**await measure(client, make_request, count, args.concurrency),
+                                             "statements_per_request": queries}
+    finally:
+        await app.router.shutdown()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--states', type=int, default=20)
+    parser.add_argument('--students', type=int, default=20000)
+    parser.add_argument('--installments', type=int, default=4)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--bulk-requests', type=int, default=5, help='requests to GET /students')
+    parser.add_argument('--login-requests', type=int, default=20, help='requests to POST /login')
+    parser.add_argument('--concurrency', type=int, default=1, help='requests in flight at once')
+    parser.add_argument('--endpoints', nargs='*', help='only these, e.g. "GET /users"')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write the results to this file')
+    args = parser.parse_args()
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Lookup latency on a seeded database, without and with the indexes of
+migrations/models/1_*_indexes.sql.
+
+    python -m benchmarks.indexes --students 20000 --repeat 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from tortoise import Tortoise
+
+from benchmarks.seed import seed
+from models.models import Students, StudentInstallments, States, Users
+
+MIGRATION = next(Path(__file__).resolve().parent.parent.joinpath('migrations', 'models').glob('1_*_indexes.sql'))
+
+
+def upgrade_statements() -> list:
+    upgrade = MIGRATION.read_text().split('-- upgrade --')[1].split('-- downgrade --')[0]
+    return [statement.strip() for statement in upgrade.split(';\n') if statement.strip()]
+
+
+async def drop_indexes():
+    conn = Tortoise.get_connection('default')
+    _, rows = await conn.execute_query("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'")
+    for row in rows:
+        await conn.execute_script(f'DROP INDEX "{row["name"]}"')
+
+
+async def create_indexes():
+    conn = Tortoise.get_connection('default')
+    for statement in upgrade_statements():
+        await conn.execute_script(statement)
+    await conn.execute_script('ANALYZE')
+
+
+async def timed(lookup, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await lookup()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {"p50_ms": round(statistics.median(samples), 3),
+            "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3)}
+
+
+async def run(args) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    await Tortoise.init(db_url=f'sqlite://{path}', modules={'models': ['models.models']})
+    await Tortoise.generate_schemas()
+    counts = await seed(students=args.students)
+
+    rnd = random.Random(2)
+    students = await Students.all().values('id', 'unique_id', 'state_id')
+    installment_uids = await StudentInstallments.all().values_list('unique_id', flat=True)
+    state_ids = await States.all().values_list('id', flat=True)
+
+    lookups = {
+        "students.unique_id": lambda: Students.filter(unique_id=rnd.choice(students)['unique_id']).first(),
+        "student_installments.unique_id": lambda: StudentInstallments.filter(
+            unique_id=rnd.choice(installment_uids)).first(),
+        "student_installments.student_id+installment_id": lambda: StudentInstallments.filter(
+            student_id=rnd.choice(students)['id'], installment_id=1).first(),
+        "students.state_id order by name": lambda: Students.filter(
+            state_id=rnd.choice(state_ids)).order_by('name').limit(100),
+        "students.sync_state = 0": lambda: Students.filter(sync_state=0).values_list('id', flat=True),
+        "users.sync_state = 0": lambda: Users.filter(sync_state=0).values_list('id', flat=True),
+    }
+    result = {"dataset": counts, "repeat": args.repeat, "lookups": {}}
+    await drop_indexes()
+    for name, lookup in lookups.items():
+        result["lookups"][name] = {"before": await timed(lookup, args.repeat)}
+    await create_indexes()
+    for name, lookup in lookups.items():
+        result["lookups"][name]["after"] = await timed(lookup, args.repeat)
+    await Tortoise.close_connections()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=200)
+    result = asyncio.run(run(parser.parse_args()))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+SQL statements and time of the authority grants as the number of users and states grows:
+a state added or edited with N users, a super user added across N states (its time
+includes hashing the password).
+
+    python -m benchmarks.permissions --sizes 10 50 200
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from uuid import uuid4
+
+from tortoise import Tortoise
+
+from benchmarks.seed import seed
+from models.models import States, Users
+from routes.general import post_state, patch_state, post_user
+from schemas.general import GeneralSchema, User
+
+
+class StatementCounter(logging.Handler):
+    # the sqlite client logs every statement it runs at debug level
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+async def measured(counter: StatementCounter, call) -> dict:
+    counter.count = 0
+    start = time.perf_counter()
+    await call
+    return {"statements": counter.count, "ms": round((time.perf_counter() - start) * 1000, 1)}
+
+
+async def run(args) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    await Tortoise.init(db_url=f'sqlite://{path}', modules={'models': ['models.models']})
+    await Tortoise.generate_schemas()
+    await seed(states=0, students=0)
+    await Users.bulk_create([Users(username=f'user {n}', password='-', unique_id=str(uuid4()), super=int(n < 3))
+                             for n in range(2 * max(args.sizes))])
+    user_ids = await Users.filter(super=0).order_by('id').values_list('id', flat=True)
+
+    logger = logging.getLogger('tortoise.db_client')
+    counter = StatementCounter()
+    logger.addHandler(counter)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+
+    result = {"super_users": 3, "sizes": {}}
+    for n in args.sizes:
+        sizes = result["sizes"][n] = {}
+        states = await States.all().count()
+        await States.bulk_create([States(name=f'state {k}', unique_id=str(uuid4())) for k in range(states, n)])
+        sizes["post_user_super"] = await measured(counter, post_user(User(
+            username=f'super {n}', password='x', authority=[], super=True)))
+        sizes["post_user_super"]["states"] = await States.all().count()
+
+        users = [{"id": user_id} for user_id in user_ids[:n]]
+        sizes["post_state"] = await measured(counter, post_state(GeneralSchema(name=f'state with {n}', users=users)))
+        state = await States.filter(name=f'state with {n}').first()
+        # half of the users swapped for others
+        swapped = users[:n // 2] + [{"id": user_id} for user_id in user_ids[n:2 * n - n // 2]]
+        sizes["patch_state"] = await measured(counter, patch_state(str(state.id), GeneralSchema(
+            name=f'state with {n}', users=swapped)))
+        sizes["post_state"]["users"] = sizes["patch_state"]["users"] = n
+    logger.removeHandler(counter)
+    await Tortoise.close_connections()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 200])
+    result = asyncio.run(run(parser.parse_args()))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
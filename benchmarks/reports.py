@@ -0,0 +1,83 @@
+"""
+Report latency as the number of students grows: the GROUP BY on a cold cache, the cached result,
+and, for reference, loading every student and installment and summing them in Python the way a
+client crunching GET /students has to (without the network and JSON).
+
+    python -m benchmarks.reports --sizes 10000 50000 --repeat 20
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+
+from tortoise import Tortoise
+
+from benchmarks.seed import seed
+from models.models import Students, StudentInstallments
+from services.changes import touch
+from services.reports import collections, outstanding
+
+DATE_FROM = datetime.date(2022, 3, 1)
+DATE_TO = datetime.date(2022, 5, 31)
+
+
+async def timed(call, repeat: int, cold: bool) -> dict:
+    times = []
+    for _ in range(repeat):
+        if cold:
+            # what a write does to the cached results
+            touch('student_installments')
+        start = time.perf_counter()
+        await call()
+        times.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": round(statistics.median(times), 2), "max_ms": round(max(times), 2)}
+
+
+async def client_side():
+    states = dict(await Students.all().values_list('id', 'state_id'))
+    by_state = defaultdict(int)
+    for date, amount, student_id in await StudentInstallments.all().values_list('date', 'amount', 'student_id'):
+        if amount and date and DATE_FROM <= date <= DATE_TO:
+            by_state[states.get(student_id)] += amount
+    return by_state
+
+
+async def run(args) -> dict:
+    result = {}
+    for n in args.sizes:
+        path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+        await Tortoise.init(db_url=f'sqlite://{path}', modules={'models': ['models.models']})
+        await Tortoise.generate_schemas()
+        await seed(students=n)
+        # payments spread over a year
+        await Tortoise.get_connection('default').execute_script(
+            "UPDATE student_installments SET date = date('2022-01-01', '+' || (id % 365) || ' days')")
+        reports = {
+            "collections_by_state": lambda: collections('state', DATE_FROM, DATE_TO),
+            "collections_by_day": lambda: collections('day', DATE_FROM, DATE_TO),
+            "outstanding_by_state": lambda: outstanding('state'),
+        }
+        sizes = result[n] = {}
+        for name, call in reports.items():
+            sizes[name] = {"cold": await timed(call, args.repeat, cold=True),
+                           "cached": await timed(call, args.repeat, cold=False)}
+        sizes["client_side_collections_by_state"] = await timed(client_side, max(1, args.repeat // 5), cold=False)
+        await Tortoise.close_connections()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000])
+    parser.add_argument('--repeat', type=int, default=20)
+    result = asyncio.run(run(parser.parse_args()))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
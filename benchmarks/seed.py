@@ -0,0 +1,70 @@
+import random
+from uuid import uuid4
+
+from models.models import Branches, Governorates, Institutes, Posters, Installments, States, Students, \
+    StudentInstallments, Users, UserAuth
+from services.auth import hash_password, server_hash
+
+BATCH_SIZE = 1000
+# arabic_names=True builds "first father grandfather" names from these, so searches meet the
+# spelling variants (ة/ه, أ/ا, ى/ي) of real data
+FIRST_NAMES = ['محمد', 'علي', 'حسين', 'أحمد', 'حسن', 'عباس', 'جبار', 'مصطفى', 'زينب', 'فاطمة', 'مريم', 'نور',
+               'هدى', 'سجاد', 'مرتضى', 'كرار', 'زهراء', 'رقية', 'عبدالله', 'يوسف', 'إبراهيم', 'ضحى', 'آيات',
+               'منتظر', 'سارة', 'رسل', 'أمير', 'حيدر', 'ياسر', 'مهدي', 'هاشم', 'إسراء', 'بتول', 'ليلى']
+FAMILY_NAMES = ['الموسوي', 'الحسيني', 'الجبوري', 'العبيدي', 'الربيعي', 'الساعدي', 'التميمي', 'الخفاجي',
+                'الزبيدي', 'الكعبي', 'البياتي', 'الدليمي', 'العزاوي', 'الشمري', 'اللامي', 'الحلي']
+
+
+def arabic_name(rnd: random.Random) -> str:
+    parts = [rnd.choice(FIRST_NAMES), rnd.choice(FIRST_NAMES), rnd.choice(FIRST_NAMES)]
+    if rnd.random() < 0.5:
+        parts.append(rnd.choice(FAMILY_NAMES))
+    return ' '.join(parts)
+
+
+async def seed(states: int = 20, students: int = 20000, installments: int = 4, unsynced: float = 0.05,
+               seed_value: int = 1, users: int = 0, states_per_user: int = 2, super_users: int = 1,
+               password: str = 'password', arabic_names: bool = False) -> dict:
+    # fills an empty database through the real models, returns the row counts;
+    # users are named user1, user2..., all with `password`, the first super_users see every state
+    rnd = random.Random(seed_value)
+    for model in (Branches, Governorates, Institutes, Posters):
+        await model.bulk_create([model(name=f'{model.__name__} {n}') for n in range(1, 6)])
+    await Installments.bulk_create([Installments(name=f'installment {n}', unique_id=str(uuid4()), sync_state=1)
+                                    for n in range(1, installments + 1)])
+    await States.bulk_create([States(name=f'state {n}', unique_id=str(uuid4()), sync_state=1)
+                              for n in range(1, states + 1)])
+    state_ids = await States.all().values_list('id', flat=True)
+    install_ids = await Installments.all().values_list('id', flat=True)
+
+    for start in range(0, students, BATCH_SIZE):
+        await Students.bulk_create([
+            Students(name=arabic_name(rnd) if arabic_names else f'student {n}', school=f'school {n % 50}',
+                     state_id=rnd.choice(state_ids), branch_id=rnd.randint(1, 5), governorate_id=rnd.randint(1, 5),
+                     institute_id=rnd.randint(1, 5), poster_id=rnd.randint(1, 5),
+                     first_phone=f'0770{n:07d}', total_amount=1000, remaining_amount=0,
+                     unique_id=str(uuid4()), sync_state=0 if rnd.random() < unsynced else 1)
+            for n in range(start, min(start + BATCH_SIZE, students))])
+
+    student_ids = await Students.all().values_list('id', flat=True)
+    for start in range(0, len(student_ids), BATCH_SIZE // installments):
+        await StudentInstallments.bulk_create([
+            StudentInstallments(student_id=student_id, installment_id=install_id, amount=250,
+                                unique_id=str(uuid4()), sync_state=0 if rnd.random() < unsynced else 1)
+            for student_id in student_ids[start:start + BATCH_SIZE // installments] for install_id in install_ids])
+
+    grants = []
+    if users:
+        # one hash for all of them, hashing is slow on purpose
+        hashed = hash_password(password)
+        await Users.bulk_create([Users(username=f'user{n}', name=arabic_name(rnd) if arabic_names else f'user {n}',
+                                       password=hashed, server_password=server_hash(password),
+                                       super=int(n <= super_users), unique_id=str(uuid4()), sync_state=1) for n in range(1, users + 1)])
+        for user_id, is_super in await Users.all().order_by('id').values_list('id', 'super'):
+            allowed = state_ids if is_super else rnd.sample(state_ids, min(states_per_user, len(state_ids)))
+            grants += [UserAuth(user_id=user_id, state_id=state_id, unique_id=str(uuid4()), sync_state=1)
+                       for state_id in allowed]
+        for start in range(0, len(grants), BATCH_SIZE):
+            await UserAuth.bulk_create(grants[start:start + BATCH_SIZE])
+    return {"states": states, "students": students, "student_installments": students * installments,
+            "users": users, "user_auth": len(grants)}
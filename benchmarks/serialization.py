@@ -0,0 +1,70 @@
+"""
+Encoding cost and size of the GET /students payload: jsonable_encoder + json
+against orjson, and what gzip saves on the wire.
+
+    python -m benchmarks.serialization --students 20000 --repeat 5
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from tortoise import Tortoise
+
+from benchmarks.seed import seed
+from models.models import Students
+from routes.general import load_student_installments, student_to_json
+from services.lookups import lookup_maps
+from settings import GZIP_LEVEL
+
+
+def timed(render, repeat: int) -> tuple:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = render()
+        samples.append((time.perf_counter() - start) * 1000)
+    return body, round(statistics.median(samples), 1)
+
+
+async def run(args) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    await Tortoise.init(db_url=f'sqlite://{path}', modules={'models': ['models.models']})
+    await Tortoise.generate_schemas()
+    counts = await seed(students=args.students)
+
+    students = await Students.all()
+    installments = await load_student_installments()
+    lookups = await lookup_maps()
+    payload = {"students": [student_to_json(stu, installments, lookups) for stu in students], "success": True}
+    await Tortoise.close_connections()
+
+    renderers = {
+        "json": lambda: JSONResponse(jsonable_encoder(payload)).body,
+        "orjson": lambda: ORJSONResponse(payload).body,
+    }
+    result = {"dataset": counts, "repeat": args.repeat, "encoders": {}}
+    for name, render in renderers.items():
+        body, encode_ms = timed(render, args.repeat)
+        compressed, gzip_ms = timed(lambda: gzip.compress(body, compresslevel=GZIP_LEVEL), args.repeat)
+        result["encoders"][name] = {"encode_ms": encode_ms, "bytes": len(body),
+                                    "gzip_ms": gzip_ms, "gzip_bytes": len(compressed)}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    result = asyncio.run(run(parser.parse_args()))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Read latency under concurrent write transactions, one shared connection
+(IMS_DB_PROFILE=default) against the tuned profile with reader connections.
+
+    python -m benchmarks.sqlite_load --students 20000 --readers 8 --seconds 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+
+from benchmarks.seed import seed
+from models.models import Students, StudentInstallments, States
+from services.storage import db_config
+
+
+async def init(path: str, profile: str, readers: int):
+    await Tortoise.init(config={
+        "connections": {"default": db_config(path, profile, readers)},
+        "apps": {"models": {"models": ["models.models"], "default_connection": "default"}},
+    })
+
+
+def percentiles(samples: list) -> dict:
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+    return {"count": len(samples), "p50_ms": round(statistics.median(samples), 2),
+            "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 2), "max_ms": round(samples[-1], 2)}
+
+
+async def read_loop(state_ids: list, until: float, samples: list, rnd: random.Random):
+    # the queries of a state's student page
+    while time.perf_counter() < until:
+        start = time.perf_counter()
+        students = await Students.filter(state_id=rnd.choice(state_ids)).order_by('id').limit(50)
+        await StudentInstallments.filter(student_id__in=[stu.id for stu in students]).values()
+        samples.append((time.perf_counter() - start) * 1000)
+
+
+async def write_loop(student_ids: list, batch: int, until: float, samples: list, rnd: random.Random):
+    # transactions the size of a sync pull
+    while time.perf_counter() < until:
+        chunk = rnd.sample(student_ids, batch)
+        start = time.perf_counter()
+        async with in_transaction():
+            await Students.filter(id__in=chunk).update(note=f'load {start}')
+            await StudentInstallments.filter(student_id__in=chunk).update(amount=rnd.randint(1, 1000))
+        samples.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0)
+
+
+async def profile_run(path: str, profile: str, args) -> dict:
+    await init(path, profile, args.db_readers)
+    state_ids = await States.all().values_list('id', flat=True)
+    student_ids = await Students.all().values_list('id', flat=True)
+    rnd = random.Random(3)
+    result = {}
+    for phase, writing in (("reads_alone", False), ("reads_during_writes", True)):
+        reads, writes = [], []
+        until = time.perf_counter() + args.seconds
+        tasks = [read_loop(state_ids, until, reads, rnd) for _ in range(args.readers)]
+        if writing:
+            tasks.append(write_loop(student_ids, args.batch, until, writes, rnd))
+        await asyncio.gather(*tasks)
+        result[phase] = {"reads": percentiles(reads), "reads_per_second": round(len(reads) / args.seconds)}
+        if writing:
+            result[phase]["write_transactions"] = percentiles(writes)
+    await Tortoise.close_connections()
+    return result
+
+
+async def run(args) -> dict:
+    directory = tempfile.mkdtemp()
+    seeded = os.path.join(directory, 'seeded.sqlite3')
+    await Tortoise.init(db_url=f'sqlite://{seeded}', modules={'models': ['models.models']})
+    await Tortoise.generate_schemas()
+    counts = await seed(students=args.students)
+    await Tortoise.close_connections()
+
+    result = {"dataset": counts, "readers": args.readers, "write_batch": args.batch, "profiles": {}}
+    for profile in ("default", "tuned"):
+        path = os.path.join(directory, f'{profile}.sqlite3')
+        shutil.copy(seeded, path)
+        result["profiles"][profile] = await profile_run(path, profile, args)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=20000)
+    parser.add_argument('--readers', type=int, default=8, help='concurrent reading tasks')
+    parser.add_argument('--db-readers', type=int, default=4, help='reader connections of the tuned profile')
+    parser.add_argument('--batch', type=int, default=2000, help='students updated per write transaction')
+    parser.add_argument('--seconds', type=float, default=5)
+    result = asyncio.run(run(parser.parse_args()))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Students per second through POST /students/import against one POST /students per student.
+
+    python -m benchmarks.student_import --students 10000 --compare 500
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+
+from tortoise import Tortoise
+
+from benchmarks.seed import seed
+from models.models import States, Students, StudentInstallments
+from routes.general import post_student
+from schemas.general import Student
+from services.imports import import_students
+from services.search import ensure_search_index
+
+HEADER = ['name', 'state', 'school', 'branch', 'governorate', 'institute', 'poster', 'first_phone',
+          'total_amount', 'remaining_amount', 'install_1_amount', 'install_1_invoice', 'install_1_date']
+
+
+def csv_file(states: list, students: int) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(HEADER)
+    for n in range(students):
+        writer.writerow([f'imported {n}', states[n % len(states)], f'school {n % 50}', 'Branches 1',
+                         'Governorates 2', 'Institutes 3', 'Posters 4', f'0780{n:07d}', 1000, 750, 250, n,
+                         '2022-09-01'])
+    return buffer.getvalue().encode()
+
+
+async def run(args) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    await Tortoise.init(db_url=f'sqlite://{path}', modules={'models': ['models.models']})
+    await Tortoise.generate_schemas()
+    await seed(students=0)
+    await ensure_search_index()
+    states = await States.all().values_list('name', flat=True)
+    state_ids = await States.all().values_list('id', flat=True)
+
+    data = csv_file(states, args.students)
+    start = time.perf_counter()
+    report = await import_students(io.BytesIO(data), 'students.csv')
+    elapsed = time.perf_counter() - start
+    result = {"import": {"students": report["imported"], "failed": report["failed"], "bytes": len(data),
+                         "seconds": round(elapsed, 2), "students_per_second": round(report["imported"] / elapsed)}}
+
+    start = time.perf_counter()
+    for n in range(args.compare):
+        await post_student(Student(name=f'posted {n}', state_id=state_ids[n % len(state_ids)], branch_id=1,
+                                   installments=[{"install_id": install_id, "amount": 250 if install_id == 1 else None}
+                                                 for install_id in (1, 2, 3, 4)]))
+    elapsed = time.perf_counter() - start
+    result["per_student"] = {"students": args.compare, "seconds": round(elapsed, 2),
+                             "students_per_second": round(args.compare / elapsed)}
+    result["rows"] = {"students": await Students.all().count(),
+                      "student_installments": await StudentInstallments.all().count()}
+    await Tortoise.close_connections()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=10000)
+    parser.add_argument('--compare', type=int, default=500, help='students added one request at a time')
+    result = asyncio.run(run(parser.parse_args()))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Sync cycles against benchmarks/sync_server.py for a seeded dataset on both sides: the first sync
+(every local row pushed, every remote row pulled), a no-op sync right after it, and an incremental
+sync after --changes local edits, --changes local additions and as many of each on the remote side.
+The stand-in server delays every request by --latency seconds and fails --failure-rate of them
+with a 503; a failed sync is started again, up to --attempts times, like the scheduler would.
+
+    python -m benchmarks.sync_cycle --students 2000 --remote-students 2000 --latency 0.01 --failure-rate 0.01
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+from tortoise import Tortoise
+
+import routes.sync
+from benchmarks import sync_server
+from benchmarks.seed import seed
+from benchmarks.sync_push import start_server
+from models.models import Installments, Outbox, States, Students, StudentInstallments, Users
+from routes.general import patch_student, post_student
+from schemas.general import Student, StudentPatch
+
+
+def totals(progress: dict, phase: str, counter: str) -> int:
+    return sum(entity.get(counter, 0) for entity in progress.get(phase, {}).values())
+
+
+async def timed_sync(attempts: int) -> dict:
+    store = sync_server.store
+    store.requests = store.failures = 0
+    errors = []
+    pushed = pulled = 0
+    start = time.perf_counter()
+    for attempt in range(1, attempts + 1):
+        await routes.sync.start_sync()
+        # every start resets the counters
+        pushed += totals(routes.sync.status['progress'], 'push', 'accepted')
+        pulled += totals(routes.sync.status['progress'], 'pull', 'received')
+        if routes.sync.status['state'] == 'done':
+            break
+        errors.append(routes.sync.status['error'])
+    return {"seconds": round(time.perf_counter() - start, 3), "done": routes.sync.status['state'] == 'done',
+            "attempts": attempt, "requests": store.requests, "failed_requests": store.failures,
+            "pushed": pushed, "pulled": pulled,
+            "left_unsynced": await Students.filter(sync_state=0).count()
+            + await StudentInstallments.filter(sync_state=0).count() + await Outbox.filter(sync_state=0).count(),
+            "errors": errors}
+
+
+async def local_changes(changes: int, rnd: random.Random):
+    # through the routes, so the edits reach the outbox like the app's own
+    student_ids = await Students.all().values_list('id', flat=True)
+    state_ids = await States.all().values_list('id', flat=True)
+    install_ids = await Installments.all().values_list('id', flat=True)
+    for student_id in rnd.sample(student_ids, min(changes, len(student_ids))):
+        await patch_student(student_id, StudentPatch(note=f'edited {rnd.random()}', installments=[
+            {"install_id": install_ids[-1], "amount": rnd.choice([0, 250, 500])}]))
+    for n in range(changes):
+        await post_student(Student(name=f'new local student {n}', state_id=rnd.choice(state_ids), branch_id=1,
+                                   installments=[{"install_id": install_id, "amount": 250}
+                                                 for install_id in install_ids]))
+
+
+def remote_changes(changes: int, rnd: random.Random):
+    store = sync_server.store
+    remote = [unique_id for unique_id, student in store.students.items() if student['name'].startswith('remote')]
+    for unique_id in rnd.sample(remote, min(changes, len(remote))):
+        store.students[unique_id].update(note=f'edited remotely {rnd.random()}', patch_state=1)
+        store.touch('students', unique_id)
+    state_ids = [unique_id for unique_id, state in store.states.items() if state['name'].startswith('remote')]
+    for n in range(changes):
+        store.add_student(f'remote student added {n}', rnd.choice(state_ids), n)
+
+
+async def run(args) -> dict:
+    server = start_server(args.port)
+    routes.sync.HOST = f'http://127.0.0.1:{args.port}'
+    # the failures are counted below, not logged
+    logging.getLogger(routes.sync.__name__).disabled = True
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    await Tortoise.init(db_url=f'sqlite://{path}', modules={'models': ['models.models']})
+    await Tortoise.generate_schemas()
+    counts = await seed(states=args.states, students=args.students, users=args.users)
+    for model in (Installments, States, Users, Students, StudentInstallments):
+        await model.all().update(sync_state=0)
+
+    store = sync_server.store
+    store.reset()
+    store.batch = not args.per_row
+    # both sides know the same installment rounds, the remote office has its own states and students
+    for name, unique_id in await Installments.all().order_by('id').values_list('name', 'unique_id'):
+        store.installment({"name": name, "unique_id": unique_id})
+    store.seed(states=args.states, students=args.remote_students, installments=0)
+    store.latency = args.latency
+    store.failure_rate = args.failure_rate
+
+    rnd = random.Random(args.seed)
+    result = {"local": counts, "remote_students": args.remote_students, "batch": store.batch,
+              "latency": args.latency, "failure_rate": args.failure_rate, "syncs": {}}
+    result["syncs"]["first"] = await timed_sync(args.attempts)
+    result["syncs"]["no_op"] = await timed_sync(args.attempts)
+    await local_changes(args.changes, rnd)
+    remote_changes(args.changes, rnd)
+    result["syncs"]["incremental"] = await timed_sync(args.attempts)
+    result["students"] = await Students.all().count()
+
+    await routes.sync.close_client()
+    await Tortoise.close_connections()
+    server.should_exit = True
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--states', type=int, default=10)
+    parser.add_argument('--students', type=int, default=2000, help='local students, all unsynced')
+    parser.add_argument('--remote-students', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--changes', type=int, default=100, help='edits and additions per side before the last sync')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every request')
+    parser.add_argument('--failure-rate', type=float, default=0, help='share of requests answered with a 503')
+    parser.add_argument('--attempts', type=int, default=5)
+    parser.add_argument('--per-row', action='store_true', help='without the batch endpoints')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--port', type=int, default=8804)
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=2))
+
+
+if __name__ == '__main__':
+    main()
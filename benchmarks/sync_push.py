@@ -0,0 +1,75 @@
+"""
+Push throughput of /sync against benchmarks/sync_server.py, batched and per-row.
+
+    python -m benchmarks.sync_push --students 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+
+import uvicorn
+from tortoise import Tortoise
+
+import routes.sync
+from benchmarks import sync_server
+from benchmarks.seed import seed
+from models.models import Installments, States, Students, StudentInstallments, Users
+
+
+def start_server(port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(sync_server.app, port=port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def no_pull():
+    pass
+
+
+async def run(args) -> dict:
+    server = start_server(args.port)
+    routes.sync.HOST = f'http://127.0.0.1:{args.port}'
+    # push only, the pull side has its own benchmark
+    routes.sync.get_all = no_pull
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    await Tortoise.init(db_url=f'sqlite://{path}', modules={'models': ['models.models']})
+    await Tortoise.generate_schemas()
+    counts = await seed(states=args.states, students=args.students, unsynced=1.0)
+
+    result = {"dataset": counts, "modes": {}}
+    for mode, batch in (("batch", True), ("per_row", False)):
+        sync_server.store.reset()
+        sync_server.store.batch = batch
+        for model in (Installments, States, Users, Students, StudentInstallments):
+            await model.all().update(sync_state=0)
+        start = time.perf_counter()
+        await routes.sync.sync()
+        elapsed = time.perf_counter() - start
+        rows = counts['states'] + counts['students'] + counts['student_installments']
+        result["modes"][mode] = {"seconds": round(elapsed, 3), "requests": sync_server.store.requests,
+                                 "rows_per_second": round(rows / elapsed),
+                                 "left_unsynced": await Students.filter(sync_state=0).count()
+                                 + await StudentInstallments.filter(sync_state=0).count()}
+    await routes.sync.close_client()
+    await Tortoise.close_connections()
+    server.should_exit = True
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--states', type=int, default=20)
+    parser.add_argument('--students', type=int, default=2000)
+    parser.add_argument('--port', type=int, default=8801)
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=2))
+
+
+if __name__ == '__main__':
+    main()
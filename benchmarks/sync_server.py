@@ -0,0 +1,241 @@
+"""
+Local stand-in of the remote sync server, keeps everything in memory.
+
+Implements the per-row endpoints routes/sync.py posts to, the collections
+get_all() pulls, and the batch protocol: GET /capabilities advertises it,
+POST /batch/{endpoint} takes {"items": [...]} and answers one result per item.
+Every write bumps a change sequence, GET collections take ?since=<watermark> and
+answer only the rows changed after it, plus the current "watermark".
+Every request can be delayed (IMS_FAKE_SYNC_LATENCY, seconds) and a share of them
+fail with a 503 before doing anything (IMS_FAKE_SYNC_FAILURE_RATE, 0 to 1).
+
+    uvicorn benchmarks.sync_server:app --port 8801
+    IMS_FAKE_SYNC_BATCH=0 uvicorn benchmarks.sync_server:app --port 8801   # per-row only
+    IMS_FAKE_SYNC_LATENCY=0.05 IMS_FAKE_SYNC_FAILURE_RATE=0.01 uvicorn benchmarks.sync_server:app --port 8801
+"""
+import asyncio
+import os
+import random
+from typing import Optional
+from uuid import uuid4
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+class Store:
+    def __init__(self):
+        self.batch = os.environ.get('IMS_FAKE_SYNC_BATCH', '1') != '0'
+        self.max_batch_size = int(os.environ.get('IMS_FAKE_SYNC_MAX_BATCH', 1000))
+        self.latency = float(os.environ.get('IMS_FAKE_SYNC_LATENCY', 0))
+        self.failure_rate = float(os.environ.get('IMS_FAKE_SYNC_FAILURE_RATE', 0))
+        self.random = random.Random(int(os.environ.get('IMS_FAKE_SYNC_SEED', 1)))
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.failures = 0
+        self.lookups = {name: [{"id": n, "name": f'{name.title()} {n}'} for n in range(1, 6)]
+                        for name in ('branches', 'governorates', 'institutes', 'posters')}
+        self.installments = {}
+        self.states = {}
+        self.students = {}
+        self.student_installments = {}
+        self.users = {}
+        self.seq = 0
+        # collection name -> {row key: seq of its last change}, the seeded lookups never change
+        self.changes = {}
+
+    def touch(self, name: str, key):
+        self.seq += 1
+        self.changes.setdefault(name, {})[key] = self.seq
+
+    def changed(self, name: str, since: Optional[int], key: str = 'unique_id') -> list:
+        rows = self.lookups[name] if name in self.lookups else list(getattr(self, name).values())
+        if since is not None:
+            changes = self.changes.get(name, {})
+            rows = [row for row in rows if changes.get(row[key], 0) > since]
+        return rows
+
+    # per-row writes, same payloads as the real server
+    def installment(self, item: dict):
+        self.installments[item['unique_id']] = {"id": len(self.installments) + 1, "name": item['name'],
+                                                "unique_id": item['unique_id']}
+        self.touch('installments', item['unique_id'])
+
+    def state(self, item: dict):
+        self.states[item['unique_id']] = {"name": item['name'], "unique_id": item['unique_id'],
+                                          "delete_state": 0, "patch_state": int(bool(item.get('patch')))}
+        self.touch('states', item['unique_id'])
+
+    def user(self, item: dict):
+        self.users[item['unique_id']] = {
+            "username": item['username'], "password": item['password'], "name": item.get('name'),
+            "unique_id": item['unique_id'], "delete_state": 0, "patch_state": int(bool(item.get('patch'))),
+            "authority": [{"state_unique_id": auth['state_unique_id'], "auth_unique_id": auth['unique_id'],
+                           "delete_state": 0} for auth in item['authority']]}
+        self.touch('users', item['unique_id'])
+
+    def student(self, item: dict):
+        if item['state_unique_id'] not in self.states:
+            raise KeyError(item['state_unique_id'])
+        student = {key: item[key] for key in ('name', 'school', 'branch_id', 'governorate_id', 'institute_id',
+                                              'first_phone', 'second_phone', 'code_1', 'code_2', 'telegram_user',
+                                              'note', 'total_amount', 'remaining_amount', 'unique_id')}
+        created_at = item['created_at']
+        student.update(created_at=None if created_at == 'None' else created_at, poster_id=item['poster'],
+                       _state={"unique_id": item['state_unique_id']}, delete_state=0,
+                       patch_state=int(bool(item.get('patch'))))
+        self.students[item['unique_id']] = student
+        self.touch('students', item['unique_id'])
+
+    def student_installment(self, item: dict):
+        if item['student_unique_id'] not in self.students:
+            raise KeyError(item['student_unique_id'])
+        date = item['date']
+        self.student_installments[item['unique_id']] = {
+            "unique_id": item['unique_id'], "invoice": item['invoice'], "amount": item['amount'],
+            "date": None if date == 'None' else date, "delete_state": 0, "patch_state": int(bool(item.get('patch'))),
+            "_student": {"unique_id": item['student_unique_id']},
+            "_installment": {"unique_id": item['install_unique_id']}}
+        self.touch('student_installments', item['unique_id'])
+
+    def delete(self, item: dict):
+        for key, name in (('unique_id_students', 'students'), ('unique_id_states', 'states'),
+                          ('unique_id_students_install', 'student_installments'), ('unique_id_users', 'users')):
+            collection = getattr(self, name)
+            for unique_id in item.get(key, []):
+                if unique_id in collection:
+                    collection[unique_id]['delete_state'] = 1
+                    self.touch(name, unique_id)
+
+    def add_student(self, name: str, state_unique_id: str, invoice: int = 0) -> str:
+        # a student of the remote dataset with one paid installment per round
+        unique_id = str(uuid4())
+        self.student({"name": name, "school": None, "branch_id": 1, "governorate_id": 1, "institute_id": 1,
+                      "first_phone": None, "second_phone": None, "code_1": None, "code_2": None,
+                      "telegram_user": None, "created_at": '2022-01-01', "note": None, "total_amount": 1000,
+                      "remaining_amount": 0, "poster": 1, "unique_id": unique_id,
+                      "state_unique_id": state_unique_id})
+        for install_id in self.installments:
+            self.student_installment({"date": '2022-01-01', "amount": 250, "invoice": invoice,
+                                      "unique_id": str(uuid4()), "install_unique_id": install_id,
+                                      "student_unique_id": unique_id})
+        return unique_id
+
+    def seed(self, states: int, students: int, installments: int = 4):
+        # a remote dataset for pull benchmarks
+        for n in range(installments):
+            self.installment({"name": f'installment {n + 1}', "unique_id": str(uuid4())})
+        state_ids = [str(uuid4()) for _ in range(states)]
+        for n, unique_id in enumerate(state_ids):
+            self.state({"name": f'remote state {n + 1}', "unique_id": unique_id})
+        for n in range(students):
+            self.add_student(f'remote student {n}', state_ids[n % states], n)
+
+
+store = Store()
+app = FastAPI()
+
+WRITERS = {
+    'installments': store.installment,
+    'state': store.state,
+    'users': store.user,
+    'student': store.student,
+    'student_installment': store.student_installment,
+}
+
+
+@app.middleware('http')
+async def count_requests(request: Request, call_next):
+    store.requests += 1
+    if store.latency:
+        await asyncio.sleep(store.latency)
+    if store.failure_rate and store.random.random() < store.failure_rate:
+        store.failures += 1
+        return JSONResponse({"success": False}, status_code=503)
+    return await call_next(request)
+
+
+@app.get('/capabilities')
+async def capabilities():
+    if not store.batch:
+        return JSONResponse({"batch": False}, status_code=404)
+    return {"batch": True, "max_batch_size": store.max_batch_size}
+
+
+@app.post('/batch/{endpoint}')
+async def batch(endpoint: str, request: Request):
+    if not store.batch or endpoint not in WRITERS:
+        return JSONResponse({"success": False}, status_code=404)
+    items = (await request.json())['items'][:store.max_batch_size]
+    results = []
+    for item in items:
+        try:
+            WRITERS[endpoint](item)
+            results.append({"unique_id": item['unique_id'], "success": True})
+        except KeyError:
+            results.append({"unique_id": item['unique_id'], "success": False})
+    return {"results": results}
+
+
+@app.post('/del')
+async def delete(request: Request):
+    store.delete(await request.json())
+    return {"success": True}
+
+
+@app.post('/{endpoint}')
+async def write(endpoint: str, request: Request):
+    if endpoint not in WRITERS:
+        return JSONResponse({"success": False}, status_code=404)
+    try:
+        WRITERS[endpoint](await request.json())
+    except KeyError:
+        return JSONResponse({"success": False}, status_code=422)
+    return {"success": True}
+
+
+@app.get('/branches')
+async def branches(since: Optional[int] = None):
+    return {"branches": store.changed('branches', since, 'id'), "watermark": store.seq}
+
+
+@app.get('/governorates')
+async def governorates(since: Optional[int] = None):
+    return {"governorates": store.changed('governorates', since, 'id'), "watermark": store.seq}
+
+
+@app.get('/institutes')
+async def institutes(since: Optional[int] = None):
+    return {"institutes": store.changed('institutes', since, 'id'), "watermark": store.seq}
+
+
+@app.get('/posters')
+async def posters(since: Optional[int] = None):
+    return {"posters": store.changed('posters', since, 'id'), "watermark": store.seq}
+
+
+@app.get('/installments')
+async def installments(since: Optional[int] = None):
+    return {"installments": store.changed('installments', since), "watermark": store.seq}
+
+
+@app.get('/states')
+async def states(since: Optional[int] = None):
+    return {"states": store.changed('states', since), "watermark": store.seq}
+
+
+@app.get('/students')
+async def students(since: Optional[int] = None):
+    return {"students": store.changed('students', since), "watermark": store.seq}
+
+
+@app.get('/users')
+async def users(since: Optional[int] = None):
+    return {"users": store.changed('users', since), "watermark": store.seq}
+
+
+@app.get('/student_installment')
+async def student_installments(since: Optional[int] = None):
+    return {"students_installments": store.changed('student_installments', since), "watermark": store.seq}
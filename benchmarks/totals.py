@@ -0,0 +1,115 @@
+"""
+GET /summary read from the trigger maintained totals against the GROUP BY over all the students
+it replaces, as the number of students grows, and what the triggers add to an import.
+Every size also checks the incremental totals against a rebuild from the rows.
+
+    python -m benchmarks.totals --sizes 1000 10000 50000 --repeat 20 --import-students 5000
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from tortoise import Tortoise
+
+from benchmarks.seed import seed
+from benchmarks.student_import import csv_file
+from models.models import States
+from services.imports import import_students
+from services.totals import TRIGGERS, ensure_totals, rebuild_totals, summary
+
+GROUP_BY = [
+    """SELECT s.state_id, COUNT(*), SUM(COALESCE(s.total_amount, 0)),
+    SUM(COALESCE((SELECT SUM(amount) FROM student_installments WHERE student_id = s.id), 0))
+    FROM students s WHERE s.state_id IS NOT NULL GROUP BY s.state_id""",
+    """SELECT s.state_id, si.installment_id, SUM(si.amount), COUNT(*)
+    FROM student_installments si JOIN students s ON s.id = si.student_id
+    WHERE si.amount IS NOT NULL AND si.amount != 0 GROUP BY s.state_id, si.installment_id""",
+]
+TABLES = ('student_totals', 'state_totals', 'installment_totals')
+
+
+async def timed(call, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await call()
+        times.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": round(statistics.median(times), 2), "max_ms": round(max(times), 2)}
+
+
+async def group_by():
+    conn = Tortoise.get_connection('default')
+    for sql in GROUP_BY:
+        await conn.execute_query(sql)
+
+
+async def snapshot() -> list:
+    # rows without their ids, zero rows left by moves and deletes don't count
+    conn = Tortoise.get_connection('default')
+    rows = []
+    for table in TABLES:
+        result = await conn.execute_query_dict(f'SELECT * FROM {table}')
+        rows.append(sorted(tuple(value for key, value in row.items() if key != 'id') for row in result
+                           if row['paid'] or row.get('students')))
+    return rows
+
+
+async def consistent() -> bool:
+    incremental = await snapshot()
+    await rebuild_totals()
+    return incremental == await snapshot()
+
+
+async def import_seconds(states: list, students: int) -> float:
+    start = time.perf_counter()
+    await import_students(io.BytesIO(csv_file(states, students)), 'students.csv')
+    return round(time.perf_counter() - start, 2)
+
+
+async def open_database(students: int):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    await Tortoise.init(db_url=f'sqlite://{path}', modules={'models': ['models.models']})
+    await Tortoise.generate_schemas()
+    # the triggers come first, so the seeded totals are the incremental ones
+    await ensure_totals()
+    await seed(students=students)
+
+
+async def run(args) -> dict:
+    result = {"sizes": {}}
+    for n in args.sizes:
+        await open_database(n)
+        result["sizes"][n] = {"consistent": await consistent(),
+                              "summary": await timed(summary, args.repeat),
+                              "group_by": await timed(group_by, args.repeat)}
+        await Tortoise.close_connections()
+
+    await open_database(max(args.sizes))
+    states = await States.all().values_list('name', flat=True)
+    result["import"] = {"students": args.import_students,
+                        "with_triggers_seconds": await import_seconds(states, args.import_students)}
+    result["import"]["consistent"] = await consistent()
+    conn = Tortoise.get_connection('default')
+    for name in TRIGGERS:
+        await conn.execute_script(f'DROP TRIGGER "{name}"')
+    result["import"]["without_triggers_seconds"] = await import_seconds(states, args.import_students)
+    await Tortoise.close_connections()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--import-students', type=int, default=5000)
+    result = asyncio.run(run(parser.parse_args()))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,24 @@
 from tortoise.contrib.fastapi import register_tortoise
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from routes.admin import admin_router
 from routes.general import general_router
-from routes.sync import sync_router
+from routes.reports import reports_router
+from routes.sync import sync_router, close_client, start_scheduler, stop_sync
+from services.search import ensure_search_index
+from services.totals import ensure_totals
+from services.auth import ensure_server_password
+from services.outbox import import_legacy_changes
+from services.compaction import start_compaction, stop_compaction
+from services.responses import JSON_RESPONSE
+from services.metrics import MetricsMiddleware
+from services.storage import db_config, ensure_indexes
+from settings import DB_PATH, GZIP_MIN_SIZE, GZIP_LEVEL, METRICS
 
 
-def create_app() -> FastAPI:
-    app = FastAPI()
+def create_app(db_path: str = DB_PATH) -> FastAPI:
+    app = FastAPI(default_response_class=JSON_RESPONSE)
 
     origins = [
         "http://localhost",
@@ -20,13 +32,30 @@ def create_app() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE, compresslevel=GZIP_LEVEL)
+    if METRICS:
+        # added last so it is outermost: times the whole stack and counts the bytes as sent
+        app.add_middleware(MetricsMiddleware)
+    # before register_tortoise, so running jobs stop ahead of the connections closing
+    app.add_event_handler("shutdown", stop_sync)
+    app.add_event_handler("shutdown", stop_compaction)
     register_tortoise(
         app,
-        db_url='sqlite://db.sqlite3',
-        modules={'models': ["models.models"]},
+        config={
+            "connections": {"default": db_config(db_path)},
+            "apps": {"models": {"models": ["models.models"], "default_connection": "default"}},
+        },
         generate_schemas=True,
         add_exception_handlers=True,
     )
+    app.add_event_handler("startup", ensure_indexes)
+    app.add_event_handler("startup", ensure_server_password)
+    app.add_event_handler("startup", ensure_search_index)
+    app.add_event_handler("startup", ensure_totals)
+    app.add_event_handler("startup", import_legacy_changes)
+    app.add_event_handler("startup", start_scheduler)
+    app.add_event_handler("startup", start_compaction)
+    app.add_event_handler("shutdown", close_client)
     register_views(app=app)
     return app
 
@@ -34,11 +63,13 @@ def create_app() -> FastAPI:
 def register_views(app: FastAPI):
     app.include_router(general_router, tags=["General"])
     app.include_router(sync_router, tags=["Sync"])
+    app.include_router(admin_router, tags=["Admin"])
+    app.include_router(reports_router, tags=["Reports"])
 
 
 TORTOISE_ORM = {
     "connections": {
-        "default": "sqlite://db.sqlite3"
+        "default": db_config()
     },
     "apps": {
         "models": {
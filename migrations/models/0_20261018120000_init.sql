@@ -0,0 +1,94 @@
+-- upgrade --
+CREATE TABLE IF NOT EXISTS "branches" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "name" TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS "governorates" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "name" TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS "installments" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "name" TEXT NOT NULL,
+    "unique_id" TEXT NOT NULL,
+    "sync_state" INT NOT NULL  DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS "institutes" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "name" TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS "posters" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "name" TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS "states" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "name" TEXT NOT NULL,
+    "unique_id" TEXT NOT NULL,
+    "sync_state" INT NOT NULL  DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS "students" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "name" TEXT NOT NULL,
+    "school" TEXT,
+    "first_phone" TEXT,
+    "second_phone" TEXT,
+    "code_1" TEXT,
+    "code_2" TEXT,
+    "telegram_user" TEXT,
+    "created_at" DATE,
+    "note" TEXT,
+    "total_amount" REAL,
+    "remaining_amount" REAL,
+    "unique_id" TEXT NOT NULL,
+    "sync_state" INT NOT NULL  DEFAULT 0,
+    "branch_id" INT REFERENCES "branches" ("id") ON DELETE CASCADE,
+    "governorate_id" INT REFERENCES "governorates" ("id") ON DELETE CASCADE,
+    "institute_id" INT REFERENCES "institutes" ("id") ON DELETE CASCADE,
+    "poster_id" INT REFERENCES "posters" ("id") ON DELETE CASCADE,
+    "state_id" INT REFERENCES "states" ("id") ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS "student_installments" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "date" DATE,
+    "amount" INT,
+    "invoice" INT,
+    "unique_id" TEXT NOT NULL,
+    "sync_state" INT NOT NULL  DEFAULT 0,
+    "installment_id" INT REFERENCES "installments" ("id") ON DELETE CASCADE,
+    "student_id" INT REFERENCES "students" ("id") ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS "temporarydelete" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "unique_id" TEXT NOT NULL,
+    "model_id" INT NOT NULL,
+    "sync_state" INT NOT NULL  DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS "temporarypatch" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "unique_id" TEXT NOT NULL,
+    "model_id" INT NOT NULL,
+    "sync_state" INT NOT NULL  DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS "users" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "username" TEXT NOT NULL,
+    "password" TEXT NOT NULL,
+    "unique_id" TEXT NOT NULL,
+    "sync_state" INT NOT NULL  DEFAULT 0,
+    "name" TEXT,
+    "super" INT NOT NULL  DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS "user_auth" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "unique_id" TEXT NOT NULL,
+    "sync_state" INT NOT NULL  DEFAULT 0,
+    "state_id" INT NOT NULL REFERENCES "states" ("id") ON DELETE CASCADE,
+    "user_id" INT NOT NULL REFERENCES "users" ("id") ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS "aerich" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "version" VARCHAR(255) NOT NULL,
+    "app" VARCHAR(20) NOT NULL,
+    "content" JSON NOT NULL
+);
@@ -0,0 +1,20 @@
+-- upgrade --
+CREATE INDEX IF NOT EXISTS "idx_students_unique__c45326" ON "students" ("unique_id");
+CREATE INDEX IF NOT EXISTS "idx_students_state_i_211994" ON "students" ("state_id", "name");
+CREATE INDEX IF NOT EXISTS "idx_students_state_i_5b09ac" ON "students" ("state_id", "id");
+CREATE INDEX IF NOT EXISTS "idx_student_ins_unique__118c1c" ON "student_installments" ("unique_id");
+CREATE INDEX IF NOT EXISTS "idx_student_ins_student_89d843" ON "student_installments" ("student_id", "installment_id");
+CREATE INDEX IF NOT EXISTS "idx_temporaryde_unique__1bdf6e" ON "temporarydelete" ("unique_id");
+CREATE INDEX IF NOT EXISTS "idx_temporarypa_unique__96382e" ON "temporarypatch" ("unique_id");
+CREATE INDEX IF NOT EXISTS "idx_user_auth_user_id_dc84b8" ON "user_auth" ("user_id", "state_id");
+CREATE INDEX IF NOT EXISTS "idx_user_auth_state_i_6a8038" ON "user_auth" ("state_id");
+-- downgrade --
+DROP INDEX IF EXISTS "idx_students_unique__c45326";
+DROP INDEX IF EXISTS "idx_students_state_i_211994";
+DROP INDEX IF EXISTS "idx_students_state_i_5b09ac";
+DROP INDEX IF EXISTS "idx_student_ins_unique__118c1c";
+DROP INDEX IF EXISTS "idx_student_ins_student_89d843";
+DROP INDEX IF EXISTS "idx_temporaryde_unique__1bdf6e";
+DROP INDEX IF EXISTS "idx_temporarypa_unique__96382e";
+DROP INDEX IF EXISTS "idx_user_auth_user_id_dc84b8";
+DROP INDEX IF EXISTS "idx_user_auth_state_i_6a8038";
@@ -0,0 +1,8 @@
+-- upgrade --
+CREATE TABLE IF NOT EXISTS "sync_meta" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "entity" VARCHAR(50) NOT NULL UNIQUE,
+    "watermark" TEXT
+);
+-- downgrade --
+DROP TABLE IF EXISTS "sync_meta";
@@ -0,0 +1,12 @@
+-- upgrade --
+CREATE TABLE IF NOT EXISTS "outbox" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "entity" VARCHAR(30) NOT NULL,
+    "operation" VARCHAR(10) NOT NULL,
+    "unique_id" TEXT NOT NULL,
+    "sync_state" INT NOT NULL  DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS "idx_outbox_unique__eecff4" ON "outbox" ("unique_id");
+CREATE INDEX IF NOT EXISTS "idx_outbox_unsynced" ON "outbox" ("id") WHERE "sync_state" = 0;
+-- downgrade --
+DROP TABLE IF EXISTS "outbox";
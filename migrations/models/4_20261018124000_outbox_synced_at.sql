@@ -0,0 +1,4 @@
+-- upgrade --
+ALTER TABLE "outbox" ADD "synced_at" TIMESTAMP;
+-- downgrade --
+ALTER TABLE "outbox" DROP COLUMN "synced_at";
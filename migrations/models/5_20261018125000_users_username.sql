@@ -0,0 +1,4 @@
+-- upgrade --
+CREATE INDEX IF NOT EXISTS "idx_users_usernam_266d85" ON "users" ("username");
+-- downgrade --
+DROP INDEX IF EXISTS "idx_users_usernam_266d85";
@@ -0,0 +1,25 @@
+-- upgrade --
+CREATE TABLE IF NOT EXISTS "student_totals" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "paid" REAL NOT NULL  DEFAULT 0,
+    "student_id" INT NOT NULL UNIQUE REFERENCES "students" ("id") ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS "state_totals" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "students" INT NOT NULL  DEFAULT 0,
+    "total_amount" REAL NOT NULL  DEFAULT 0,
+    "paid" REAL NOT NULL  DEFAULT 0,
+    "state_id" INT NOT NULL UNIQUE REFERENCES "states" ("id") ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS "installment_totals" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "paid" REAL NOT NULL  DEFAULT 0,
+    "payments" INT NOT NULL  DEFAULT 0,
+    "installment_id" INT NOT NULL REFERENCES "installments" ("id") ON DELETE CASCADE,
+    "state_id" INT NOT NULL REFERENCES "states" ("id") ON DELETE CASCADE,
+    CONSTRAINT "uid_installment_state_i_55aca7" UNIQUE ("state_id", "installment_id")
+);
+-- downgrade --
+DROP TABLE IF EXISTS "installment_totals";
+DROP TABLE IF EXISTS "state_totals";
+DROP TABLE IF EXISTS "student_totals";
@@ -0,0 +1,4 @@
+-- upgrade --
+CREATE INDEX IF NOT EXISTS "idx_student_ins_date_9e7884" ON "student_installments" ("date", "student_id", "amount");
+-- downgrade --
+DROP INDEX IF EXISTS "idx_student_ins_date_9e7884";
@@ -0,0 +1,4 @@
+-- upgrade --
+ALTER TABLE "users" ADD "server_password" TEXT;
+-- downgrade --
+ALTER TABLE "users" DROP COLUMN "server_password";
@@ -8,6 +8,9 @@ class Installments(Model):
     unique_id = fields.TextField()
     sync_state = fields.IntField(default=0)  # 0 offline, 1 synced
 
+    class Meta:
+        indexes = (("unique_id",),)
+
 
 class Branches(Model):
     id = fields.IntField(pk=True)
@@ -43,6 +46,12 @@ class Users(Model):
     sync_state = fields.IntField(default=0)
     name = fields.TextField(null=True)
     super = fields.IntField(default=0)
+    # the hash the sync server checks, see services.auth.server_hash
+    server_password = fields.TextField(null=True)
+
+    class Meta:
+        # username serves the login lookup
+        indexes = (("unique_id",), ("username",))
 
 
 class UserAuth(Model):
@@ -54,6 +63,7 @@ class UserAuth(Model):
 
     class Meta:
         table = "user_auth"
+        indexes = (("unique_id",), ("user_id", "state_id"), ("state_id",))
 
 
 class Students(Model):
@@ -77,6 +87,10 @@ class Students(Model):
     unique_id = fields.TextField()
     sync_state = fields.IntField(default=0)
 
+    class Meta:
+        # (state_id, id) serves the keyset pages of a state's students
+        indexes = (("unique_id",), ("state_id", "name"), ("state_id", "id"))
+
 
 class StudentInstallments(Model):
     id = fields.IntField(pk=True)
@@ -90,6 +104,8 @@ class StudentInstallments(Model):
 
     class Meta:
         table = "student_installments"
+        # (date, student_id, amount) covers the date ranges of services/reports.py
+        indexes = (("unique_id",), ("student_id", "installment_id"), ("date", "student_id", "amount"))
 
 
 class States(Model):
@@ -98,7 +114,12 @@ class States(Model):
     unique_id = fields.TextField()
     sync_state = fields.IntField(default=0)
 
+    class Meta:
+        indexes = (("unique_id",),)
+
 
+# TemporaryDelete and TemporaryPatch are the change log of older versions,
+# pending rows are moved into Outbox on startup.
 class TemporaryDelete(Model):
     id = fields.IntField(pk=True)
     unique_id = fields.TextField()
@@ -108,6 +129,9 @@ class TemporaryDelete(Model):
     '''
     sync_state = fields.IntField(default=0)
 
+    class Meta:
+        indexes = (("unique_id",),)
+
 
 class TemporaryPatch(Model):
     id = fields.IntField(pk=True)
@@ -117,3 +141,65 @@ class TemporaryPatch(Model):
     model_id = {"Students": 1, "states": 2, "student_installment": 3, "users": 4}
     '''
     sync_state = fields.IntField(default=0)
+
+    class Meta:
+        indexes = (("unique_id",),)
+
+
+class SyncMeta(Model):
+    id = fields.IntField(pk=True)
+    entity = fields.CharField(max_length=50, unique=True)
+    # last change sequence of the remote collection that was pulled, sent back as ?since=
+    watermark = fields.TextField(null=True)
+
+    class Meta:
+        table = "sync_meta"
+
+
+class Outbox(Model):
+    # id is the change sequence, sqlite AUTOINCREMENT never hands out a value twice
+    id = fields.IntField(pk=True)
+    entity = fields.CharField(max_length=30)  # student, state, student_installment, user
+    operation = fields.CharField(max_length=10)  # patch, delete
+    unique_id = fields.TextField()
+    sync_state = fields.IntField(default=0)
+    synced_at = fields.DatetimeField(null=True)  # when the server acknowledged it
+
+    class Meta:
+        table = "outbox"
+        indexes = (("unique_id",),)
+
+
+# Financial totals, kept up to date by the triggers of services/totals.py in the
+# transaction of every installment and student write.
+class StudentTotals(Model):
+    id = fields.IntField(pk=True)
+    student = fields.OneToOneField("models.Students", related_name=False)
+    paid = fields.FloatField(default=0)  # sum of the student's installment amounts
+
+    class Meta:
+        table = "student_totals"
+
+
+class StateTotals(Model):
+    id = fields.IntField(pk=True)
+    state = fields.OneToOneField("models.States", related_name=False)
+    students = fields.IntField(default=0)
+    total_amount = fields.FloatField(default=0)  # sum of the students' total_amount
+    paid = fields.FloatField(default=0)
+
+    class Meta:
+        table = "state_totals"
+
+
+class InstallmentTotals(Model):
+    # per state and installment round
+    id = fields.IntField(pk=True)
+    state = fields.ForeignKeyField("models.States", related_name=False)
+    installment = fields.ForeignKeyField("models.Installments", related_name=False)
+    paid = fields.FloatField(default=0)
+    payments = fields.IntField(default=0)  # installments with an amount
+
+    class Meta:
+        table = "installment_totals"
+        unique_together = (("state", "installment"),)
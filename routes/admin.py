@@ -0,0 +1,55 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from services import metrics
+from services.compaction import compact
+from settings import OUTBOX_RETENTION_DAYS
+
+admin_router = APIRouter()
+
+
+# POST `/admin/compact`
+#
+# - Prunes the sync change log: acknowledged outbox entries older than the retention window or
+#   superseded by a newer entry of the same record, pending duplicates, and the acknowledged rows
+#   of the legacy TemporaryPatch/TemporaryDelete tables.
+# - Request Arguments: dry_run (report only, default false), retention_days.
+# - Returns: reclaimed rows and bytes per table, bytes is null when sqlite can't measure them.
+#
+# Example Response `{
+#     "dry_run": true,
+#     "retention_days": 30,
+#     "tables": {
+#         "outbox": {"rows": 120, "bytes": 8192},
+#         "temporarypatch": {"rows": 1114, "bytes": 65536},
+#         "temporarydelete": {"rows": 186, "bytes": 16384}
+#     },
+#     "rows": 1420,
+#     "bytes": 90112,
+#     "success": true
+# }`
+@admin_router.post('/admin/compact')
+async def post_compact(dry_run: bool = False, retention_days: float = OUTBOX_RETENTION_DAYS):
+    return dict(await compact(dry_run, retention_days), success=True)
+
+
+# GET `/metrics`
+#
+# - Request, database and sync metrics since the server started, in the Prometheus text format.
+#   Per route (the path template, "unmatched" for a 404 without one): latency by status,
+#   response bytes, SQL statements and database time. Requests in flight by method. Per sync
+#   step (push, patch or pull of an entity, the deletes): duration and rows, and whole syncs by result.
+#   Empty series when IMS_METRICS=0.
+# - Request Arguments: None
+# - Returns: text/plain, one sample per line.
+#
+# Example Response `
+# # HELP ims_http_request_duration_seconds Time from the request to the last byte of its response.
+# # TYPE ims_http_request_duration_seconds histogram
+# ims_http_request_duration_seconds_bucket{method="GET",route="/states/{state_id}/students",status="200",le="0.005"} 912
+# ...
+# ims_sync_step_duration_seconds_sum{phase="push",entity="students"} 3.41
+# `
+@admin_router.get('/metrics', response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
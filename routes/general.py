@@ -2,13 +2,24 @@ import os
 import signal
 from typing import Optional
 from uuid import uuid4
-from fastapi import APIRouter, Depends
-from models.models import Institutes, Governorates, States, Students, Installments, StudentInstallments, \
-    Users, UserAuth, TemporaryPatch, TemporaryDelete, Branches, Posters
+from fastapi import APIRouter, Depends, Request, Response, Header, File, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
+from models.models import States, Students, Installments, StudentInstallments, Users, UserAuth
 from tortoise.transactions import in_transaction
-from schemas.general import GeneralSchema, Student, StudentInstall, User, Login
-import hashlib
+from schemas.general import GeneralSchema, Student, StudentPatch, StudentInstall, User, Login
+from services.search import search_students, index_students, unindex_students, prune_index
+from services.lookups import lookup_maps, cached_response, id_names
+from services.changes import touch, etag, not_modified, STUDENT_TABLES
+from services.responses import json_response, json_line
+from services.outbox import record, discard, PATCH, DELETE
+from services.imports import import_students, UnsupportedFile, UnreadableFile
+from services.permissions import grant_state, grant_user
+from services.totals import summary, student_summary
+from services.storage import chunks
+from services.auth import make_password, server_hash, verify_password, needs_upgrade, get_authority, open_session, \
+    current_session, forget_user, authorities, sessions
 import datetime
+import math
 from fastapi_pagination import paginate, Params as ps
 
 # todo: complete sync_state
@@ -33,10 +44,15 @@ general_router = APIRouter()
 #     "success": true,
 # }`
 @general_router.get('/states')
-async def get_states():
-    query = await States.all().values('id', 'name')
-
-    return {"success": True, "total_states": await States.all().count(), "states": query}
+async def get_states(request: Request):
+    tag = etag('states')
+    cached = not_modified(request, tag)
+    if cached is not None:
+        return cached
+    response = await cached_response('states', lambda names: {"success": True, "total_states": len(names),
+                                                              "states": id_names(names)})
+    response.headers['ETag'] = tag
+    return response
 
 
 # POST `/states`
@@ -54,18 +70,10 @@ async def post_state(schema: GeneralSchema):
         unique_id = str(uuid4())
         new = States(name=schema.name, unique_id=unique_id)
         await new.save(using_db=conn)
-        users = await Users.filter(super=1).all()
-        for user in users:
-            sup = UserAuth(state_id=new.id, user_id=user.id,
-                           unique_id=str(uuid4()))
-            await sup.save(using_db=conn)
-            await Users.filter(super=1).update(sync_state=0)
-
-        for user_id in schema.users:
-            auth = UserAuth(state_id=new.id, user_id=user_id.id,
-                            unique_id=str(uuid4()))
-            await auth.save(using_db=conn)
-            await Users.filter(id=user_id.id).update(sync_state=0)
+        granted = await grant_state(new.id, [user.id for user in schema.users], using_db=conn)
+    for user_id in granted:
+        authorities.pop(user_id)
+    touch('states', 'user_auth')
 
     return {
         "success": True,
@@ -91,18 +99,12 @@ async def post_state(schema: GeneralSchema):
 async def patch_state(state_id, schema: GeneralSchema):
     await States.filter(id=state_id).update(name=schema.name)
     patch = await States.filter(id=state_id).first().values('unique_id')
-    temporary = await TemporaryPatch.filter(unique_id=patch['unique_id']).first()
     async with in_transaction() as conn:
-        if temporary is None:
-            new = TemporaryPatch(unique_id=patch['unique_id'], model_id=2)
-            await new.save(using_db=conn)
-        for user in await Users.filter(super=0):
-            await UserAuth.filter(state_id=state_id, user_id=user.id).delete()
-        for user_id in schema.users:
-            auth = UserAuth(state_id=state_id,
-                            user_id=user_id.id, unique_id=str(uuid4()))
-            await auth.save(using_db=conn)
-            await Users.filter(id=user_id.id).update(sync_state=0)
+        await record('state', PATCH, [patch['unique_id']], using_db=conn)
+        await grant_state(int(state_id), [user.id for user in schema.users], using_db=conn)
+    # the new name shows in the authority of every user of the state
+    authorities.clear()
+    touch('states', 'user_auth')
 
     return {
         "success": True,
@@ -124,10 +126,11 @@ async def patch_state(state_id, schema: GeneralSchema):
 async def del_state(state_id):
     q = await States.filter(id=state_id).first()
     await States.filter(id=state_id).delete()
-    await TemporaryPatch.filter(unique_id=q.unique_id).delete()
-    async with in_transaction() as conn:
-        new = TemporaryDelete(unique_id=q.unique_id, model_id=2)
-        await new.save(using_db=conn)
+    # the state's students and authorities went with it (on delete cascade)
+    await prune_index()
+    authorities.clear()
+    touch('states', 'students', 'student_installments', 'user_auth')
+    await record('state', DELETE, [q.unique_id])
     return {
         "success": True,
         "name": q.name
@@ -182,12 +185,44 @@ async def post_student(schema: Student):
                                                       amount=student_install.amount, invoice=student_install.invoice,
                                                       student_id=new.id, unique_id=unique_id2)
             await new_student_install.save(using_db=conn)
-        return {"success": True,
-                "name": new.name}
+        await index_students([new.id], using_db=conn)
+    touch('students', 'student_installments')
+    return {"success": True,
+            "name": new.name}
+
+
+# POST `/students/import`
+# - Add many students from an uploaded .csv (UTF-8) or .xlsx file, multipart field `file`.
+# - The first row names the columns: name, state (name or id), school, branch, governorate, institute,
+#   poster (each a name or an id), first_phone, second_phone, code_1, code_2, telegram_username,
+#   total_amount, remaining_amount, note, created_at, and per installment install_<id>_amount,
+#   install_<id>_invoice, install_<id>_date.
+# - Every student gets a row per installment. Rows that fail validation are skipped and reported
+#   by their line number, the others are saved.
+# - Returns: number of students imported and the errors. 415 for another file type, 400 for a file
+#   that can't be read (a CSV not in UTF-8, a corrupt xlsx) with the number of students saved
+#   before it broke off, 0 when the file is refused up front.
+# Example Response `{
+#     "success": true,
+#     "imported": 998,
+#     "failed": 2,
+#     "errors": [{"row": 7, "errors": ["branch: unknown 'علمي2'"]}, {"row": 15, "errors": ["state: field required"]}]
+# }`
+@general_router.post('/students/import')
+async def post_students_import(file: UploadFile = File(...)):
+    try:
+        report = await import_students(file.file, file.filename)
+    except UnsupportedFile as exc:
+        return JSONResponse({"success": False, "message": str(exc)}, status_code=415)
+    except UnreadableFile as exc:
+        return JSONResponse({"success": False, "message": str(exc), "imported": exc.imported}, status_code=400)
+    return {"success": True, **report}
 
 
 # Patch `/students/{student_id}`
-# - edit the student .
+# - edit the student, only the fields sent are compared with the stored ones and only the
+#   changed columns and installments are written (created_at is kept). An edit that changes
+#   nothing writes nothing and is not synced.
 # - Request Arguments: None.
 # - Returns: name of student.
 # Example Request Payload `{
@@ -205,53 +240,90 @@ async def post_student(schema: Student):
 #     "total_amount": "1",
 #     "installments":[{"install_id":int, "amount":float, "invoice":int, "date":str}, {}, {},{}]
 #     "remaining_amount": "1",
-#     "note": "1",
-#     "created_at":str
+#     "note": "1"
 # }`
 # Example Response `{
 #     "name": "جبار علي",
 #     "success": true
 # }`
 
+# Students column of a StudentPatch field when the names differ
+PATCH_COLUMNS = {"telegram_username": "telegram_user"}
+# the columns services.search indexes
+SEARCH_COLUMNS = {'name', 'school', 'first_phone', 'second_phone', 'code_1', 'code_2', 'telegram_user', 'state_id'}
+# the tables the summaries read, their ETags change with any of them
+SUMMARY_TABLES = ("students", "student_installments", "installments", "states")
+
+
+def as_date(value):
+    # installment dates arrive as text and are stored as dates
+    if isinstance(value, str):
+        try:
+            return datetime.date.fromisoformat(value)
+        except ValueError:
+            pass
+    return value
+
+
 @general_router.patch('/students/{student_id}')
-async def patch_student(student_id, schema: Student):
-    date_now = datetime.datetime.now().strftime('%Y-%m-%d')
-    poster_id = None
-    if schema.poster_id != 0:
-        poster_id = schema.poster_id
-    await Students.filter(id=student_id).update(name=schema.name, school=schema.school,
-                                                branch_id=schema.branch_id,
-                                                governorate_id=schema.governorate_id,
-                                                institute_id=schema.institute_id,
-                                                state_id=schema.state_id,
-                                                first_phone=schema.first_phone,
-                                                second_phone=schema.second_phone,
-                                                code_1=schema.code_1,
-                                                code_2=schema.code_2,
-                                                telegram_user=schema.telegram_username, created_at=date_now,
-                                                note=schema.note,
-                                                total_amount=schema.total_amount,
-                                                remaining_amount=schema.remaining_amount,
-                                                poster_id=poster_id)
-    name = await Students.filter(id=student_id).first().values('name', 'unique_id')
-    async with in_transaction() as conn:
-        new = TemporaryPatch(unique_id=name['unique_id'], model_id=1)
-        await new.save(using_db=conn)
-    for student_install in schema.installments:
-        await StudentInstallments.filter(student_id=student_id, installment_id=student_install.install_id).update(
-            date=student_install.date,
-            amount=student_install.amount,
-            invoice=student_install.invoice)
-        q = await StudentInstallments.filter(student_id=student_id, installment_id=student_install.install_id
-                                             ).first().values('unique_id')
-        async with in_transaction() as coon:
-            new = TemporaryPatch(unique_id=q['unique_id'], model_id=3)
-            await new.save(using_db=coon)
-
-    name = name['name']
+async def patch_student(student_id: int, schema: StudentPatch):
+    student = await Students.filter(id=student_id).first()
+    if student is None:
+        return JSONResponse({"success": False}, status_code=404)
+    sent = schema.dict(exclude_unset=True)
+    for field in ('name', 'state_id'):
+        # not nullable, null counts as not sent
+        if field in sent and sent[field] is None:
+            del sent[field]
+    installments = sent.pop('installments', None) or []
+    if sent.get('poster_id') == 0:
+        sent['poster_id'] = None
+    changed = {}
+    for field, value in sent.items():
+        column = PATCH_COLUMNS.get(field, field)
+        if getattr(student, column) != value:
+            changed[column] = value
+
+    stored = {}
+    for row in await StudentInstallments.filter(student_id=student.id).order_by('id'):
+        stored.setdefault(row.installment_id, []).append(row)
+    patched = []
+    added = []
+    for install in installments:
+        install_id = install.pop('install_id')
+        if 'date' in install:
+            install['date'] = as_date(install['date'])
+        if install_id not in stored:
+            added.append(StudentInstallments(installment_id=install_id, student_id=student.id,
+                                             unique_id=str(uuid4()), **install))
+            continue
+        rows = stored[install_id]
+        diff = {column: value for column, value in install.items() if getattr(rows[0], column) != value}
+        if diff:
+            patched.append((rows, diff))
+
+    if changed or patched or added:
+        async with in_transaction() as conn:
+            if changed:
+                await Students.filter(id=student.id).using_db(conn).update(**changed)
+                await record('student', PATCH, [student.unique_id], using_db=conn)
+                if SEARCH_COLUMNS & changed.keys():
+                    await index_students([student.id], using_db=conn)
+            for rows, diff in patched:
+                await StudentInstallments.filter(id__in=[row.id for row in rows]).using_db(conn).update(**diff)
+            if patched:
+                await record('student_installment', PATCH, [rows[0].unique_id for rows, _ in patched],
+                             using_db=conn)
+            if added:
+                await StudentInstallments.bulk_create(added, using_db=conn)
+        if changed:
+            touch('students')
+        if patched or added:
+            touch('student_installments')
+
     return {
         "success": True,
-        "name": name
+        "name": changed.get('name', student.name)
     }
 
 
@@ -269,17 +341,14 @@ async def patch_student(student_id, schema: Student):
 async def del_student(student_id):
     student = await Students.filter(id=student_id).first().values('name', 'unique_id')
     name = student['name']
-    installments = await StudentInstallments.filter(student_id=student_id).all()
-    for installment in installments:
-        await TemporaryPatch.filter(unique_id=installment.unique_id).delete()
+    installments = await StudentInstallments.filter(student_id=student_id).values_list('unique_id', flat=True)
+    await discard(installments)
 
     await Students.filter(id=student_id).delete()
+    await unindex_students([int(student_id)])
 
-    await TemporaryPatch.filter(unique_id=student['unique_id']).delete()
-
-    async with in_transaction() as conn:
-        new = TemporaryDelete(unique_id=student['unique_id'], model_id=1)
-        await new.save(using_db=conn)
+    await record('student', DELETE, [student['unique_id']])
+    touch('students', 'student_installments')
     return {
         "success": True,
         "name": name
@@ -347,127 +416,260 @@ class Params(ps):
     search: Optional[str] = None
     page: Optional[int] = 1
     number_of_students: int = 100
-
-
-@general_router.get('/students')
-async def get_students():
-    students = await Students.all().prefetch_related('branch', 'governorate', 'institute', 'state', 'poster').all()
-    students_list = []
+    after: Optional[int] = None
+    before: Optional[int] = None
+
+
+async def load_student_installments(student_ids: Optional[list] = None) -> dict:
+    # one set-based query (or one per IN_CHUNK_SIZE ids) instead of one query per student,
+    # grouped in memory as {student_id: [installment, ...]}
+    installments = {}
+    for chunk in [None] if student_ids is None else chunks(student_ids):
+        query = StudentInstallments.all()
+        if chunk is not None:
+            query = query.filter(student_id__in=chunk)
+        rows = await query.order_by('id').values('student_id', 'date', 'amount', 'invoice', 'installment_id',
+                                                 'installment__name')
+        for row in rows:
+            installments.setdefault(row['student_id'], []).append(
+                {"install_id": row['installment_id'], "date": row['date'], "amount": row['amount'],
+                 "invoice": row['invoice'], "installment_id": row['installment_id'],
+                 "installment_name": row['installment__name']})
+    return installments
+
+
+def student_to_json(stu, installments: dict, lookups: dict) -> dict:
     student_json = {}
-    for stu in students:
-        student_json['name'] = stu.name
-        student_json['id'] = stu.id
-        student_json['school'] = stu.school
-        student_json['code_1'] = stu.code_1
-        student_json['code_2'] = stu.code_2
-        student_json['first_phone'] = stu.first_phone
-        student_json['second_phone'] = stu.second_phone
-        student_json['telegram_username'] = stu.telegram_user
-        student_json['created_at'] = stu.created_at
-        student_json['note'] = stu.note
-        student_json['total_amount'] = stu.total_amount
-        student_json['remaining_amount'] = stu.remaining_amount
-        if stu.branch is not None:
-            student_json['branch'] = {
-                "id": stu.branch.id, 'name': stu.branch.name}
-        if stu.governorate is not None:
-            student_json['governorate'] = {
-                "id": stu.governorate.id, "name": stu.governorate.name}
-        if stu.institute is not None:
-            student_json['institute'] = {
-                'id': stu.institute.id, "name": stu.institute.name}
-        if stu.state is not None:
-            student_json['state'] = {
-                'id': stu.state.id, 'name': stu.state.name}
-        if stu.poster is not None:
-            student_json['poster'] = {
-                'id': stu.poster.id, 'name': stu.poster.name}
-        student_install = await StudentInstallments.filter(student_id=stu.id).prefetch_related('installment').all()
-        install_list = []
-        for stu_install in student_install:
-            single_install = {"install_id": stu_install.installment.id, "date": stu_install.date, "amount": stu_install.amount,
-                              "invoice": stu_install.invoice, "installment_id": stu_install.installment.id,
-                              "installment_name": stu_install.installment.name}
-            install_list.append(single_install)
-        student_json['installments'] = install_list
-        students_list.append(student_json)
-        student_json = {}
-
-    return {"students": students_list, "success": True}
+    student_json['name'] = stu.name
+    student_json['id'] = stu.id
+    student_json['school'] = stu.school
+    student_json['code_1'] = stu.code_1
+    student_json['code_2'] = stu.code_2
+    student_json['first_phone'] = stu.first_phone
+    student_json['second_phone'] = stu.second_phone
+    student_json['telegram_username'] = stu.telegram_user
+    student_json['created_at'] = stu.created_at
+    student_json['note'] = stu.note
+    student_json['total_amount'] = stu.total_amount
+    student_json['remaining_amount'] = stu.remaining_amount
+    # lookups: the id -> name maps of services.lookups, instead of joining every row
+    if stu.branch_id in lookups['branches']:
+        student_json['branch'] = {
+            "id": stu.branch_id, 'name': lookups['branches'][stu.branch_id]}
+    if stu.governorate_id in lookups['governorates']:
+        student_json['governorate'] = {
+            "id": stu.governorate_id, "name": lookups['governorates'][stu.governorate_id]}
+    if stu.institute_id in lookups['institutes']:
+        student_json['institute'] = {
+            'id': stu.institute_id, "name": lookups['institutes'][stu.institute_id]}
+    if stu.state_id in lookups['states']:
+        student_json['state'] = {
+            'id': stu.state_id, 'name': lookups['states'][stu.state_id]}
+    if stu.poster_id in lookups['posters']:
+        student_json['poster'] = {
+            'id': stu.poster_id, 'name': lookups['posters'][stu.poster_id]}
+    student_json['installments'] = installments.get(stu.id, [])
+    return student_json
+
+
+# Rows per query when streaming, keeps memory flat whatever the table size.
+STREAM_CHUNK_SIZE = 500
+
+
+async def stream_students():
+    # walks Students by id in chunks and yields one JSON line per student
+    last_id = 0
+    while True:
+        students = await Students.filter(id__gt=last_id).order_by('id').limit(STREAM_CHUNK_SIZE)
+        if not students:
+            break
+        installments = await load_student_installments([stu.id for stu in students])
+        lookups = await lookup_maps()
+        yield b''.join(json_line(student_to_json(stu, installments, lookups)) for stu in students)
+        last_id = students[-1].id
+
+
+# GET '/students?stream=1' (or header `Accept: application/x-ndjson`)
+# = same students as below, streamed as newline delimited JSON, one student per line
+# Responses carry an ETag (so do /students-names, /users and /states), send it back as
+# If-None-Match and an unchanged list answers 304 without a query.
+@general_router.get('/students')
+async def get_students(request: Request, stream: bool = False):
+    stream = stream or 'application/x-ndjson' in request.headers.get('accept', '')
+    tag = etag(*STUDENT_TABLES, variant='ndjson' if stream else '')
+    cached = not_modified(request, tag)
+    if cached is not None:
+        return cached
+    if stream:
+        return StreamingResponse(stream_students(), media_type='application/x-ndjson', headers={"ETag": tag})
+    students = await Students.all()
+    installments = await load_student_installments()
+    lookups = await lookup_maps()
+    students_list = [student_to_json(stu, installments, lookups) for stu in students]
+
+    return json_response({"students": students_list, "success": True}, headers={"ETag": tag})
 
 
 @general_router.get('/students-names')
-async def get_students_names():
+async def get_students_names(request: Request, response: Response):
+    tag = etag('students')
+    cached = not_modified(request, tag)
+    if cached is not None:
+        return cached
+    response.headers['ETag'] = tag
     students = await Students.all().values("id", "name")
 
     return {"students": students, "success": True}
 
 
+async def keyset_page(state_id, params: Params) -> tuple:
+    query = Students.filter(state_id=state_id)
+    if params.search is not None:
+        query = query.filter(name__icontains=params.search)
+    count = await query.count()
+
+    size = params.number_of_students
+    if params.after is not None:
+        page_query = query.filter(id__gt=params.after).order_by('id')
+    elif params.before is not None:
+        page_query = query.filter(id__lt=params.before).order_by('-id')
+    else:
+        page_query = query.order_by('id').offset((params.page - 1) * size)
+    # one extra row tells whether there is anything past this page
+    students = await page_query.limit(size + 1)
+    has_more = len(students) > size
+    students = students[:size]
+    if params.before is not None:
+        students.reverse()
+
+    next_cursor = None
+    prev_cursor = None
+    if students:
+        if has_more or params.before is not None:
+            next_cursor = students[-1].id
+        if (has_more and params.before is not None) or params.after is not None or \
+                (params.after is None and params.before is None and params.page > 1):
+            prev_cursor = students[0].id
+    return count, students, next_cursor, prev_cursor
+
+
+# GET '/states/{state_id}/students'
+# = students of a state, `page` based or keyset based: pass the `next_cursor` of a response as `after`
+# (or its `prev_cursor` as `before`) and deep pages cost the same as the first one.
+# `search` matches the start of words in name, school, phones, codes and telegram user, ignoring
+# Arabic spelling variants, best matches first (page numbers only, no cursors).
 @general_router.get('/states/{state_id}/students')
 async def get_state_students(state_id, params: Params = Depends()):
-
+    size = params.number_of_students
+    found = None
     if params.search is not None:
-        count = await Students.filter(state_id=state_id, name__icontains=params.search).prefetch_related('branch', 'governorate', 'institute', 'state',
-                                                                                                         'poster').all()
-        students = await Students.filter(state_id=state_id, name__icontains=params.search).prefetch_related('branch', 'governorate', 'institute', 'state',
-                                                                                                            'poster').all().limit(params.number_of_students).offset((params.page - 1) *
-                                                                                                                                                                    params.number_of_students)
-    else:
-        count = await Students.filter(state_id=state_id).prefetch_related('branch', 'governorate', 'institute', 'state',
-                                                                          'poster').all()
-        students = await Students.filter(state_id=state_id).prefetch_related('branch', 'governorate', 'institute', 'state',
-                                                                             'poster').all().limit(params.number_of_students).offset((params.page - 1) *
-                                                                                                                                     params.number_of_students)
-    count = len(count)
-    students_list = []
-    student_json = {}
-    for stu in students:
-        student_json['name'] = stu.name
-        student_json['id'] = stu.id
-        student_json['school'] = stu.school
-        student_json['code_1'] = stu.code_1
-        student_json['code_2'] = stu.code_2
-        student_json['first_phone'] = stu.first_phone
-        student_json['second_phone'] = stu.second_phone
-        student_json['telegram_username'] = stu.telegram_user
-        student_json['created_at'] = stu.created_at
-        student_json['note'] = stu.note
-        student_json['total_amount'] = stu.total_amount
-        student_json['remaining_amount'] = stu.remaining_amount
-        if stu.branch is not None:
-            student_json['branch'] = {
-                "id": stu.branch.id, 'name': stu.branch.name}
-        if stu.governorate is not None:
-            student_json['governorate'] = {
-                "id": stu.governorate.id, "name": stu.governorate.name}
-        if stu.institute is not None:
-            student_json['institute'] = {
-                'id': stu.institute.id, "name": stu.institute.name}
-        if stu.state is not None:
-            student_json['state'] = {
-                'id': stu.state.id, 'name': stu.state.name}
-        if stu.poster is not None:
-            student_json['poster'] = {
-                'id': stu.poster.id, 'name': stu.poster.name}
-        student_install = await StudentInstallments.filter(student_id=stu.id).prefetch_related('installment').all()
-        install_list = []
-        for stu_install in student_install:
-            single_install = {"date": stu_install.date, "amount": stu_install.amount,
-                              "invoice": stu_install.invoice, "install_id": stu_install.installment.id,
-                              "installment_name": stu_install.installment.name}
-            install_list.append(single_install)
-        student_json['installments'] = install_list
-        students_list.append(student_json)
-        student_json = {}
-    if len(students) <= params.number_of_students:
-        pages = 1
+        found = await search_students(state_id, params.search, size, (params.page - 1) * size)
+    if found is not None:
+        # ranked full text matches, paged by page number only
+        count, ids = found
+        next_cursor = None
+        prev_cursor = None
+        rank = {student_id: n for n, student_id in enumerate(ids)}
+        students = await Students.filter(id__in=ids)
+        students.sort(key=lambda stu: rank[stu.id])
     else:
-        pages = int(round(len(students) / params.number_of_students))
+        count, students, next_cursor, prev_cursor = await keyset_page(state_id, params)
+
+    installments = await load_student_installments([stu.id for stu in students])
+    lookups = await lookup_maps()
+    students_list = [student_to_json(stu, installments, lookups) for stu in students]
+    pages = max(1, math.ceil(count / size))
+
+    return json_response({"students": students_list, "success": True,
+                          "total_students": count,
+                          "page": params.page,
+                          "total_pages": pages,
+                          "next_cursor": next_cursor,
+                          "prev_cursor": prev_cursor})
 
-    return {"students": students_list, "success": True,
-            "total_students": count,
-            "page": params.page,
-            "total_pages": pages}
+
+# GET `/summary`
+#
+# - Collected and outstanding amounts per state and per installment round, read from the totals
+#   the database keeps up to date on every write, so the cost doesn't grow with the students.
+# - Request Arguments: state_id (optional, one state only).
+# - Returns: the states with their totals.
+#
+# Example Response `{
+#     "states": [
+#         {
+#             "id": 1,
+#             "name": "منصور صيفي",
+#             "students": 2087,
+#             "total_amount": 1025550.0,
+#             "paid": 550600.0,
+#             "outstanding": 474950.0,
+#             "installments": [
+#                 {
+#                     "id": 1,
+#                     "name": "القسط الاول",
+#                     "paid": 550600.0,
+#                     "payments": 2202
+#                 }
+#             ]
+#         }
+#     ],
+#     "success": true
+# }`
+@general_router.get('/summary')
+async def get_summary(request: Request, state_id: Optional[int] = None):
+    tag = etag(*SUMMARY_TABLES, variant=str(state_id or ''))
+    cached = not_modified(request, tag)
+    if cached is not None:
+        return cached
+    response = json_response({**await summary(state_id), "success": True})
+    response.headers['ETag'] = tag
+    return response
+
+
+# GET `/states/<state_id>/summary`
+#
+# - The `/summary` of one state.
+# - Request Arguments: None.
+# - Returns: the state's totals, zero for a state without students.
+@general_router.get('/states/{state_id}/summary')
+async def get_state_summary(request: Request, state_id: int):
+    tag = etag(*SUMMARY_TABLES, variant=str(state_id))
+    cached = not_modified(request, tag)
+    if cached is not None:
+        return cached
+    states = (await summary(state_id))['states']
+    if not states:
+        if not await States.filter(id=state_id).exists():
+            return JSONResponse({"success": False}, status_code=404)
+        states = [{"id": state_id, "name": (await lookup_maps())['states'].get(state_id), "students": 0,
+                   "total_amount": 0, "paid": 0, "installments": [], "outstanding": 0}]
+    response = json_response({**states[0], "success": True})
+    response.headers['ETag'] = tag
+    return response
+
+
+# GET `/students/<student_id>/summary`
+#
+# - Paid to date and outstanding amount of a student.
+# - Request Arguments: None.
+# - Returns: the student's totals.
+#
+# Example Response `{
+#     "id": 1,
+#     "name": "جبار علي",
+#     "total_amount": 1000.0,
+#     "remaining_amount": 750.0,
+#     "paid": 250.0,
+#     "outstanding": 750.0,
+#     "success": true
+# }`
+@general_router.get('/students/{student_id}/summary')
+async def get_student_summary(student_id: int):
+    student = await student_summary(student_id)
+    if student is None:
+        return JSONResponse({"success": False}, status_code=404)
+    return {**student, "success": True}
 
 
 # GET `/users`
@@ -494,14 +696,19 @@ async def get_state_students(state_id, params: Params = Depends()):
 #   "success": true
 # }'
 @general_router.get('/users')
-async def get_users():
+async def get_users(request: Request, response: Response):
+    tag = etag('users', 'user_auth', 'states')
+    cached = not_modified(request, tag)
+    if cached is not None:
+        return cached
+    response.headers['ETag'] = tag
     users = await Users.all()
     result_list = []
     for user in users:
         result_json = {"id": user.id, "username": user.username,
                        'name': user.name, "super": user.super}
         authority = []
-        auth = await UserAuth.filter(user_id=user.id).prefetch_related('state').all()
+        auth = await UserAuth.filter(user_id=user.id).order_by('id').prefetch_related('state').all()
         for au in auth:
             auth_json = {"authority_id": au.id,
                          "name": au.state.name, "id": au.state.id}
@@ -536,25 +743,17 @@ async def get_users():
 async def post_user(schema: User):
     async with in_transaction() as conn:
         unique_id = str(uuid4())
-        password = hashlib.md5(schema.password.encode())
-        new = Users(username=schema.username, password=password.hexdigest(
-        ), unique_id=unique_id, name=schema.name)
+        password = await make_password(schema.password)
+        new = Users(username=schema.username, password=password, server_password=server_hash(schema.password),
+                    unique_id=unique_id, name=schema.name)
         if schema.super:
-            new = Users(username=schema.username, password=password.hexdigest(), unique_id=unique_id, name=schema.name,
-                        super=1)
+            new.super = 1
         await new.save(using_db=conn)
         if not schema.super:
-            for state in schema.authority:
-                unique_id = str(uuid4())
-                auth = UserAuth(
-                    user_id=new.id, state_id=state.id, unique_id=unique_id)
-                await auth.save(using_db=conn)
+            await grant_user(new.id, [state.id for state in schema.authority or []], using_db=conn)
         else:
-            for state in await States.all():
-                unique_id = str(uuid4())
-                auth = UserAuth(
-                    user_id=new.id, state_id=state.id, unique_id=unique_id)
-                await auth.save(using_db=conn)
+            await grant_user(new.id, using_db=conn)
+    touch('users', 'user_auth')
     return {
         "success": True
     }
@@ -580,20 +779,14 @@ async def post_user(schema: User):
 @general_router.patch('/users/{user_id}')
 async def patch_user(user_id, schema: User):
     get_user = await Users.filter(id=user_id).first()
-    password = hashlib.md5(schema.password.encode())
-    await Users.filter(id=user_id).update(username=schema.username, password=password.hexdigest(), name=schema.name,
-                                          sync_state=0, super=0)
-    if schema.super:
-        await Users.filter(id=user_id).update(username=schema.username, password=password.hexdigest(), name=schema.name,
-                                              sync_state=0, super=1)
-    # get_auth = await UserAuth.filter(user_id=get_user.id).first()
-    await UserAuth.filter(user_id=get_user.id).delete()
+    password = await make_password(schema.password)
+    await Users.filter(id=user_id).update(username=schema.username, password=password,
+                                          server_password=server_hash(schema.password), name=schema.name,
+                                          sync_state=0, super=int(bool(schema.super)))
+    forget_user(get_user.id)
     async with in_transaction() as conn:
-        for state in schema.authority:
-            unique_id = str(uuid4())
-            auth = UserAuth(user_id=get_user.id,
-                            state_id=state.id, unique_id=unique_id)
-            await auth.save(using_db=conn)
+        await grant_user(get_user.id, [state.id for state in schema.authority or []], using_db=conn)
+    touch('users', 'user_auth')
     return {
         "success": True
     }
@@ -605,30 +798,44 @@ async def patch_user(user_id, schema: User):
 # response: {"success": True}
 @general_router.post('/login')
 async def login(schema: Login):
-    users = await Users.all()
-    for user in users:
-        if user.username == schema.username:
-            password = schema.password.encode()
-            password = hashlib.md5(password)
-            if user.password == password.hexdigest():
-                states = []
-                auth = await UserAuth.filter(user_id=user.id).all().prefetch_related('state')
-                for state in auth:
-                    state = {"name": state.state.name, "id": state.state.id}
-                    states.append(state)
-                return {
-                    "success": True,
-                    "token": str(uuid4()),
-                    "username": user.username,
-                    "name": user.name,
-                    "password": user.password,
-                    "authority": states,
-                    "super": user.super
-                }
-            else:
-                return {
-                    "success": False
-                }
+    user = await Users.filter(username=schema.username).order_by('id').first()
+    if user is None or not await verify_password(schema.password, user.password):
+        return {
+            "success": False
+        }
+    if needs_upgrade(user.password) or user.server_password is None:
+        # a local rehash, what the server checks stays the same and isn't pushed again
+        await Users.filter(id=user.id).update(password=await make_password(schema.password),
+                                              server_password=server_hash(schema.password))
+    return {
+        "success": True,
+        "token": open_session(user),
+        "username": user.username,
+        "name": user.name,
+        "authority": await get_authority(user.id),
+        "super": user.super
+    }
+
+
+# GET - '/session'
+# request header: Authorization: Bearer <token from /login>
+# response: {"user_id": 1, "username": "krvhrv", "name": null, "super": 0,
+#            "authority": [{"name": "الكويت", "id": 1}], "success": True}
+# 401 when the token is unknown or expired.
+@general_router.get('/session')
+async def get_session(session: dict = Depends(current_session)):
+    return dict(session, success=True)
+
+
+# POST - '/logout'
+# request header: Authorization: Bearer <token from /login>
+# response: {"success": True}
+@general_router.post('/logout')
+async def logout(authorization: str = Header('')):
+    sessions.pop(authorization.replace('Bearer ', '', 1))
+    return {
+        "success": True
+    }
 
 
 @general_router.get('/shutdown')
@@ -639,42 +846,31 @@ async def shutdown():
 
 @general_router.get('/governorates')
 async def get_governorates():
-    return {
-        "success": True,
-        "governorates": await Governorates.all()
-    }
+    return await cached_response('governorates', lambda names: {"success": True, "governorates": id_names(names)})
 
 
 @general_router.get('/branches')
 async def get_branches():
-    return {
-        "branches": await Branches.all(),
-        "success": True
-    }
+    return await cached_response('branches', lambda names: {"branches": id_names(names), "success": True})
 
 
 @general_router.get('/posters')
 async def get_posters():
-    return {
-        "posters": await Posters.all(),
-        "success": True
-    }
+    return await cached_response('posters', lambda names: {"posters": id_names(names), "success": True})
 
 
 @general_router.get('/institutes')
 async def get_institutes():
-    return {
-        "institutes": await Institutes.all()
-    }
+    return await cached_response('institutes', lambda names: {"institutes": id_names(names)})
 
 
 @general_router.delete('/users/{user_id}')
 async def del_user(user_id):
     get_user = await Users.filter(id=user_id).first()
     await Users.filter(id=user_id).delete()
-    async with in_transaction() as conn:
-        new = TemporaryDelete(unique_id=get_user.unique_id, model_id=4)
-        await new.save(using_db=conn)
+    forget_user(get_user.id)
+    await record('user', DELETE, [get_user.unique_id])
+    touch('users', 'user_auth')
     return {
         "success": True, "user": get_user.name
     }
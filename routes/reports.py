@@ -0,0 +1,83 @@
+import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+from services.changes import etag, not_modified
+from services.responses import json_response
+from services.reports import REPORT_TABLES, UnknownGroup, collections, outstanding
+
+reports_router = APIRouter()
+
+
+def tagged(request: Request, *variant) -> tuple:
+    # (ETag of this report's parameters, the 304 to answer when the client already holds it)
+    tag = etag(*REPORT_TABLES, variant='-'.join('' if value is None else str(value) for value in variant))
+    return tag, not_modified(request, tag)
+
+
+# GET `/reports/collections`
+#
+# - Payments received, summed by `group_by`: day, installment, state, branch, governorate,
+#   institute or poster. A payment is a student installment with an amount, dated by its date.
+# - Request Arguments: group_by (default day), date_from, date_to (YYYY-MM-DD, inclusive),
+#   state_id (one state only).
+# - Returns: a row per group and the overall payments and amount.
+#
+# Example Response `{
+#     "group_by": "state",
+#     "date_from": "2022-07-01",
+#     "date_to": "2022-07-31",
+#     "state_id": null,
+#     "rows": [
+#         {"id": 91, "name": "المنصور صيفي", "payments": 1450, "students": 1432, "amount": 362500},
+#         {"id": 92, "name": "بابل صيفي", "payments": 402, "students": 401, "amount": 80400}
+#     ],
+#     "payments": 1852,
+#     "amount": 442900,
+#     "success": true
+# }`
+@reports_router.get('/reports/collections')
+async def get_collections(request: Request, group_by: str = 'day', date_from: Optional[datetime.date] = None,
+                          date_to: Optional[datetime.date] = None, state_id: Optional[int] = None):
+    tag, cached = tagged(request, 'collections', group_by, date_from, date_to, state_id)
+    if cached is not None:
+        return cached
+    try:
+        report = await collections(group_by, date_from, date_to, state_id)
+    except UnknownGroup as exc:
+        return JSONResponse({"success": False, "message": str(exc)}, status_code=400)
+    return json_response({**report, "success": True}, headers={'ETag': tag})
+
+
+# GET `/reports/outstanding`
+#
+# - Students whose payments fall short of their total amount, and the amount they still owe,
+#   by `group_by`: state, branch, governorate, institute or poster.
+# - Request Arguments: group_by (default state), as_of (YYYY-MM-DD: only payments made and students
+#   added up to that day count, default all), state_id (one state only).
+# - Returns: a row per group and the overall students and outstanding amount.
+#
+# Example Response `{
+#     "group_by": "state",
+#     "as_of": null,
+#     "state_id": null,
+#     "rows": [
+#         {"id": 91, "name": "المنصور صيفي", "students": 1901, "outstanding": 474950.0}
+#     ],
+#     "students": 1901,
+#     "outstanding": 474950.0,
+#     "success": true
+# }`
+@reports_router.get('/reports/outstanding')
+async def get_outstanding(request: Request, group_by: str = 'state', as_of: Optional[datetime.date] = None,
+                          state_id: Optional[int] = None):
+    tag, cached = tagged(request, 'outstanding', group_by, as_of, state_id)
+    if cached is not None:
+        return cached
+    try:
+        report = await outstanding(group_by, as_of, state_id)
+    except UnknownGroup as exc:
+        return JSONResponse({"success": False, "message": str(exc)}, status_code=400)
+    return json_response({**report, "success": True}, headers={'ETag': tag})
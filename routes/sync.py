@@ -1,9 +1,23 @@
+import asyncio
+import datetime
+import logging
+import time
+from typing import Optional
+
+import httpx
 from fastapi import APIRouter
-import requests
 from tortoise.transactions import in_transaction
 
-from models.models import Installments, States, Users, UserAuth, Students, StudentInstallments, TemporaryDelete, \
-    TemporaryPatch, Branches, Governorates, Institutes, Posters
+from models.models import Installments, States, Users, UserAuth, Students, StudentInstallments, Branches, \
+    Governorates, Institutes, Posters, SyncMeta
+from services.outbox import pending, acknowledge, PATCH, DELETE
+from services.auth import ALGORITHM, authorities, close_sessions
+from services.changes import touch
+from services.metrics import SYNC_SECONDS, sync_step
+from services.search import index_students, prune_index
+from services.storage import IN_CHUNK_SIZE, chunks
+from settings import SYNC_HOST, SYNC_CONNECT_TIMEOUT, SYNC_TIMEOUT, SYNC_MAX_CONNECTIONS, \
+    SYNC_KEEPALIVE_EXPIRY, SYNC_BATCH_SIZE, SYNC_INTERVAL
 
 """
 Dear Programmer:
@@ -15,17 +29,50 @@ total_hours_wasted_here = 48
 """
 sync_router = APIRouter()
 
-HOST = "http://65.20.73.107"
+HOST = SYNC_HOST
+
+_client: Optional[httpx.AsyncClient] = None
+_job: Optional[asyncio.Task] = None
+_scheduler: Optional[asyncio.Task] = None
+
+# the running or last sync job, served by GET /sync/status
+status = {"state": "idle", "phase": None, "started_at": None, "finished_at": None, "error": None, "progress": {}}
+# entity -> (start, rows) of its pull, the step ends once save_watermark stores what was applied
+_pulls = {}
+
+
+def get_client() -> httpx.AsyncClient:
+    # one pooled keep-alive client for every sync request, so the event loop keeps serving the API
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(SYNC_TIMEOUT, connect=SYNC_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=SYNC_MAX_CONNECTIONS,
+                                max_keepalive_connections=SYNC_MAX_CONNECTIONS,
+                                keepalive_expiry=SYNC_KEEPALIVE_EXPIRY))
+    return _client
 
 
-async def get_users() -> list:
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def pushed_password(user, pbkdf2: bool) -> str:
+    # the local pbkdf2 hash only goes to a server that verifies it, others get the hash they know
+    return user.password if pbkdf2 else user.server_password or user.password
+
+
+async def get_users(pbkdf2: bool = False) -> list:
     users = await Users.filter(sync_state=0).all()
     result_list = []
     for user in users:
-        result_json = {"password": user.password, "username": user.username, "unique_id": user.unique_id,
-                       "name": user.name}
+        result_json = {"password": pushed_password(user, pbkdf2), "username": user.username,
+                       "unique_id": user.unique_id, "name": user.name}
         authority = []
-        auth = await UserAuth.filter(user_id=user.id).prefetch_related('state').all()
+        auth = await UserAuth.filter(user_id=user.id).order_by('id').prefetch_related('state').all()
         for au in auth:
             auth_json = {"state_unique_id": au.state.unique_id,
                          "unique_id": au.unique_id}
@@ -35,47 +82,6 @@ async def get_users() -> list:
     return result_list
 
 
-async def get_del() -> dict:
-    all_deleted = await TemporaryDelete.filter(sync_state=0).all()
-    unique_id_students = []
-    unique_id_students_install = []
-    unique_id_states = []
-    unique_id_users = []
-    for deleted in all_deleted:
-        if deleted.model_id == 1:
-            unique_id_students.append(deleted.unique_id)
-        elif deleted.model_id == 2:
-            unique_id_states.append(deleted.unique_id)
-        elif deleted.model_id == 3:
-            unique_id_students_install.append(deleted.unique_id)
-        elif deleted.model_id == 4:
-            unique_id_users.append(deleted.unique_id)
-        await TemporaryDelete.filter(id=deleted.id).update(sync_state=1)
-    return {
-        "unique_id_students": unique_id_students, "unique_id_students_install": unique_id_students_install,
-        "unique_id_states": unique_id_states, "unique_id_users": unique_id_users
-    }
-
-
-async def get_edits() -> tuple:
-    tp = await TemporaryPatch.filter(sync_state=0).all()
-    students = []
-    states = []
-    student_installment = []
-    users = []
-    for item in tp:
-        if item.model_id == 1:
-            students.append(item.unique_id)
-        if item.model_id == 2:
-            states.append(item.unique_id)
-        if item.model_id == 3:
-            student_installment.append(item.unique_id)
-        if item.model_id == 4:
-            users.append(item.unique_id)
-
-    return students, states, student_installment, users
-
-
 def student_json(student) -> dict:
     branch_id = None
     if student.branch:
@@ -100,266 +106,468 @@ def student_json(student) -> dict:
             "unique_id": student.unique_id}
 
 
+async def pull(client: httpx.AsyncClient, entity: str, key: str) -> tuple:
+    # only asks for the rows changed since the stored watermark, servers without watermarks answer in full
+    meta = await SyncMeta.filter(entity=entity).first()
+    params = {"since": meta.watermark} if meta is not None and meta.watermark is not None else None
+    start = time.perf_counter()
+    req = await client.get(f'{HOST}/{entity}', params=params)
+    req.raise_for_status()
+    body = req.json()
+    count('pull', entity, received=len(body[key]))
+    _pulls[entity] = (start, len(body[key]))
+    return body[key], body.get('watermark')
+
+
+async def save_watermark(entity: str, watermark):
+    # stored once the pulled rows are applied, a failed sync pulls the same changes again
+    if entity in _pulls:
+        start, rows = _pulls.pop(entity)
+        sync_step('pull', entity, time.perf_counter() - start, rows)
+    if watermark is None:
+        return
+    await SyncMeta.update_or_create(defaults={"watermark": str(watermark)}, entity=entity)
+
+
+async def local_ids(model, key: str = 'unique_id') -> dict:
+    # key -> local id, loaded once per entity so reconciling a pull is a dict lookup per row
+    return dict(await model.all().values_list(key, 'id'))
+
+
+def latest(rows: list) -> list:
+    # a row changed twice between pulls is listed twice, the last one wins
+    return list({row['unique_id']: row for row in rows}.values())
+
+
+async def delete_unique_ids(model, unique_ids: list, using_db):
+    for chunk in chunks(unique_ids):
+        await model.filter(unique_id__in=chunk).using_db(using_db).delete()
+
+
+async def pull_lookup(client: httpx.AsyncClient, model, entity: str):
+    rows, watermark = await pull(client, entity, entity)
+    names = set(await model.all().values_list('name', flat=True))
+    new = []
+    for row in rows:
+        if row['name'] not in names:
+            names.add(row['name'])
+            new.append(model(id=row['id'], name=row['name']))
+    async with in_transaction() as conn:
+        await model.bulk_create(new, using_db=conn)
+    if new:
+        touch(entity)
+    await save_watermark(entity, watermark)
+
+
+STUDENT_FIELDS = ['name', 'school', 'branch_id', 'governorate_id', 'institute_id', 'first_phone', 'second_phone',
+                  'code_1', 'code_2', 'telegram_user', 'created_at', 'note', 'total_amount', 'remaining_amount',
+                  'poster_id']
+
+
+def student_fields(student: dict, state_id: int) -> dict:
+    return dict({key: student[key] for key in STUDENT_FIELDS}, state_id=state_id, sync_state=1)
+
+
 async def get_all():
-    branche_req = requests.get(f'{HOST}/branches')
-    branches = await Branches.all().values('name')
-    branches = [n['name'] for n in branches]
-    branche_req = branche_req.json()
-    branche_req = branche_req['branches']
-    for branch in branche_req:
-        if branch['name'] not in branches:
-            async with in_transaction() as conn:
-                new = Branches(id=branch['id'], name=branch['name'])
-                await new.save(using_db=conn)
-    governorates_req = requests.get(f'{HOST}/governorates')
-    governorates = await Governorates.all().values('name')
-    governorates = [n['name'] for n in governorates]
-    governorates_req = governorates_req.json()
-    governorates_req = governorates_req['governorates']
-    for governorate in governorates_req:
-        if governorate['name'] not in governorates:
-            async with in_transaction() as conn:
-                new = Governorates(
-                    id=governorate['id'], name=governorate['name'])
-                await new.save(using_db=conn)
-    installments_req = requests.get(f'{HOST}/installments')
-    installments = await Installments.all().values('unique_id')
-    installments = [n['unique_id'] for n in installments]
-    installments_req = installments_req.json()
-    installments_req = installments_req['installments']
-    for installment in installments_req:
+    client = get_client()
+    set_phase('pull')
+    await pull_lookup(client, Branches, 'branches')
+    await pull_lookup(client, Governorates, 'governorates')
+
+    installments_req, installments_mark = await pull(client, 'installments', 'installments')
+    installments = await local_ids(Installments)
+    new = []
+    for installment in latest(installments_req):
         if installment['unique_id'] not in installments:
-            async with in_transaction() as conn:
-                new = Installments(id=installment['id'], name=installment['name'], unique_id=installment['unique_id'],
-                                   sync_state=1)
-                await new.save(using_db=conn)
-    institutes_req = requests.get(f'{HOST}/institutes')
-    institutes = await Institutes.all().values('name')
-    institutes = [n['name'] for n in institutes]
-    institutes_req = institutes_req.json()
-    institutes_req = institutes_req['institutes']
-    for institute in institutes_req:
-        if institute['name'] not in institutes:
-            async with in_transaction() as conn:
-                new = Institutes(id=institute['id'], name=institute['name'])
-                await new.save(using_db=conn)
-    posters_req = requests.get(f'{HOST}/posters')
-    posters = await Posters.all().values('name')
-    posters = [n['name'] for n in posters]
-    posters_req = posters_req.json()
-    posters_req = posters_req['posters']
-    for poster in posters_req:
-        if poster['name'] not in posters:
-            async with in_transaction() as conn:
-                new = Posters(id=poster['id'], name=poster['name'])
-                await new.save(using_db=conn)
-    states_req = requests.get(f'{HOST}/states')
-    states = await States.all().values('unique_id')
-    states = [n['unique_id'] for n in states]
-    states_req = states_req.json()
-    states_req = states_req['states']
-    for state in states_req:
+            new.append(Installments(id=installment['id'], name=installment['name'],
+                                    unique_id=installment['unique_id'], sync_state=1))
+    async with in_transaction() as conn:
+        await Installments.bulk_create(new, using_db=conn)
+    if new:
+        touch('installments')
+    await save_watermark('installments', installments_mark)
+
+    await pull_lookup(client, Institutes, 'institutes')
+    await pull_lookup(client, Posters, 'posters')
+
+    states_req, states_mark = await pull(client, 'states', 'states')
+    states = await local_ids(States)
+    deleted, new, patched = [], [], []
+    for state in latest(states_req):
         if state['unique_id'] in states and state['delete_state'] == 1:
-            await States.filter(unique_id=state['unique_id']).delete()
+            deleted.append(state['unique_id'])
         elif state['unique_id'] not in states and state['delete_state'] == 0:
-            async with in_transaction() as conn:
-                new = States(
-                    name=state['name'], unique_id=state['unique_id'], sync_state=1)
-                await new.save(using_db=conn)
+            new.append(States(name=state['name'], unique_id=state['unique_id'], sync_state=1))
         elif state['unique_id'] in states and state['delete_state'] == 0 and state['patch_state'] == 1:
-            await States.filter(unique_id=state['unique_id']).update(name=state['name'])
-    students_req = requests.get(f'{HOST}/students')
-    students = await Students.all().values('unique_id')
-    students = [n['unique_id'] for n in students]
-    student_req = students_req.json()
-    student_req = student_req['students']
-    for student in student_req:
+            patched.append(States(id=states[state['unique_id']], name=state['name']))
+    async with in_transaction() as conn:
+        await delete_unique_ids(States, deleted, conn)
+        await States.bulk_create(new, using_db=conn)
+        if patched:
+            await States.bulk_update(patched, ['name'], IN_CHUNK_SIZE)
+    if deleted or new or patched:
+        # a deleted state takes its students and authorities along
+        touch('states', 'students', 'student_installments', 'user_auth')
+    await save_watermark('states', states_mark)
+
+    student_req, students_mark = await pull(client, 'students', 'students')
+    states = await local_ids(States)
+    students = await local_ids(Students)
+    deleted, new, patched = [], [], []
+    for student in latest(student_req):
+        state_id = states.get(student['_state']['unique_id'])
         if student['unique_id'] in students and student['delete_state'] == 1:
-            await Students.filter(unique_id=student['unique_id']).delete()
+            deleted.append(student['unique_id'])
+        elif state_id is None:
+            # its state was deleted or never pulled
+            continue
         elif student['unique_id'] not in students and student['delete_state'] == 0:
-            async with in_transaction() as conn:
-                st = await States.filter(unique_id=student['_state']['unique_id']).first()
-                new = Students(name=student['name'], school=student['school'], branch_id=student['branch_id'],
-                               governorate_id=student['governorate_id'], institute_id=student['institute_id'],
-                               state_id=st.id, first_phone=student['first_phone'],
-                               second_phone=student['second_phone'], code_1=student['code_1'], code_2=student['code_2'],
-                               telegram_user=student['telegram_user'], created_at=student['created_at'],
-                               note=student['note'],
-                               total_amount=student['total_amount'],
-                               remaining_amount=student['remaining_amount'], poster_id=student['poster_id'],
-                               unique_id=student['unique_id'], sync_state=1)
-                await new.save(using_db=conn)
+            new.append(Students(unique_id=student['unique_id'], **student_fields(student, state_id)))
         elif student['unique_id'] in students and student['delete_state'] == 0 and student['patch_state'] == 1:
-            st = await States.filter(unique_id=student['_state']['unique_id']).first()
-            await Students.filter(unique_id=student['unique_id']).update(name=student['name'], school=student['school'],
-                                                                         branch_id=student['branch_id'],
-                                                                         governorate_id=student['governorate_id'],
-                                                                         institute_id=student['institute_id'],
-                                                                         state_id=st.id,
-                                                                         first_phone=student['first_phone'],
-                                                                         second_phone=student['second_phone'],
-                                                                         code_1=student['code_1'],
-                                                                         code_2=student['code_2'],
-                                                                         telegram_user=student[
-                                                                             'telegram_user'],
-                                                                         created_at=student['created_at'],
-                                                                         note=student['note'],
-                                                                         total_amount=student['total_amount'],
-                                                                         remaining_amount=student['remaining_amount'],
-                                                                         poster_id=student['poster_id'],
-                                                                         sync_state=1)
-    users_auth_req = requests.get(f'{HOST}/users')
-    users_auth_req = users_auth_req.json()
-    users_auth_req = users_auth_req['users']
-    users = await Users.all().values('unique_id')
-    users = [n['unique_id'] for n in users]
-    for user in users_auth_req:
+            patched.append(Students(id=students[student['unique_id']], **student_fields(student, state_id)))
+    async with in_transaction() as conn:
+        await delete_unique_ids(Students, deleted, conn)
+        await Students.bulk_create(new, using_db=conn)
+        if patched:
+            await Students.bulk_update(patched, STUDENT_FIELDS + ['state_id', 'sync_state'], IN_CHUNK_SIZE)
+    students = await local_ids(Students)
+    await index_students([students[student.unique_id] for student in new] + [student.id for student in patched])
+    await prune_index()
+    if deleted or new or patched:
+        touch('students', 'student_installments')
+    await save_watermark('students', students_mark)
+
+    users_auth_req, users_mark = await pull(client, 'users', 'users')
+    users = await local_ids(Users)
+    deleted, new, patched = [], [], []
+    for user in latest(users_auth_req):
         if user['unique_id'] in users and user['delete_state'] == 1:
-            await Users.filter(unique_id=user['unique_id']).delete()
+            deleted.append(user['unique_id'])
         elif user['unique_id'] not in users and user['delete_state'] == 0:
-            async with in_transaction() as conn:
-                new = Users(username=user['username'], password=user['password'], unique_id=user['unique_id'],
-                            sync_state=1, name=user['name'])
-                await new.save(using_db=conn)
-                for auth in user['authority']:
-                    if auth['delete_state'] != 1:
-                        st_auth = await States.filter(unique_id=auth['state_unique_id']).first()
-                        new2 = UserAuth(state_id=st_auth.id, user_id=new.id, unique_id=auth['auth_unique_id'],
-                                        sync_state=0)
-                        await new2.save(using_db=conn)
-
+            new.append(user)
         elif user['unique_id'] in users and user['delete_state'] == 0 and user['patch_state'] == 1:
-            await Users.filter(unique_id=user['unique_id']).update(sync_state=1, username=user['username'],
-                                                                   password=user['password'], name=user['name'])
-            get_user = await Users.filter(unique_id=user['unique_id']).first()
+            patched.append(user)
+    deleted_ids = [users[unique_id] for unique_id in deleted]
+    async with in_transaction() as conn:
+        await delete_unique_ids(Users, deleted, conn)
+        # the server's hash is also the one to push back, the login upgrades the local one
+        await Users.bulk_create([Users(username=user['username'], password=user['password'],
+                                       server_password=user['password'], unique_id=user['unique_id'],
+                                       sync_state=1, name=user['name'])
+                                 for user in new], using_db=conn)
+        if patched:
+            await Users.bulk_update([Users(id=users[user['unique_id']], username=user['username'],
+                                           password=user['password'], server_password=user['password'],
+                                           name=user['name'], sync_state=1)
+                                     for user in patched],
+                                    ['username', 'password', 'server_password', 'name', 'sync_state'], IN_CHUNK_SIZE)
+        # the authorities of a patched user are replaced, deleted ones are dropped
+        await delete_unique_ids(UserAuth, [auth['auth_unique_id'] for user in patched
+                                           for auth in user['authority']], conn)
+        users = dict(await Users.all().using_db(conn).values_list('unique_id', 'id'))
+        auths = []
+        for user in new + patched:
             for auth in user['authority']:
-                if auth['delete_state'] != 1:
-                    await UserAuth.filter(unique_id=auth['auth_unique_id']).delete()
-                    async with in_transaction() as conn:
-                        st_auth = await States.filter(unique_id=auth['state_unique_id']).first()
-                        new2 = UserAuth(state_id=st_auth.id, user_id=get_user.id, unique_id=auth['auth_unique_id'],
-                                        sync_state=0)
-                        await new2.save(using_db=conn)
-                if auth['delete_state'] == 1:
-                    await UserAuth.filter(unique_id=auth['auth_unique_id']).delete()
-    student_installments_req = requests.get(f'{HOST}/student_installment')
-    student_installments = await StudentInstallments.all().values('unique_id')
-    student_installments_req = student_installments_req.json()
-    student_installments = [n['unique_id'] for n in student_installments]
-    reqs = student_installments_req['students_installments']
-    for req in reqs:
+                state_id = states.get(auth['state_unique_id'])
+                if auth['delete_state'] != 1 and state_id is not None:
+                    auths.append(UserAuth(state_id=state_id, user_id=users[user['unique_id']],
+                                          unique_id=auth['auth_unique_id'], sync_state=0))
+        await UserAuth.bulk_create(auths, using_db=conn)
+    for user_id in deleted_ids:
+        close_sessions(user_id)
+    # pulled states and users change who may see what
+    authorities.clear()
+    if deleted or new or patched:
+        touch('users', 'user_auth')
+    await save_watermark('users', users_mark)
+
+    reqs, student_installments_mark = await pull(client, 'student_installment', 'students_installments')
+    installments = await local_ids(Installments)
+    student_installments = await local_ids(StudentInstallments)
+    deleted, new, patched = [], [], []
+    for req in latest(reqs):
         if req['unique_id'] in student_installments and req['delete_state'] == 1:
-            await StudentInstallments.filter(unique_id=req['unique_id']).delete()
+            deleted.append(req['unique_id'])
+            continue
+        student_id = students.get(req['_student']['unique_id'])
+        if student_id is None:
+            continue
+        fields = {"sync_state": 1, "invoice": req['invoice'], "student_id": student_id, "date": req['date'],
+                  "installment_id": installments.get(req['_installment']['unique_id']), "amount": req['amount']}
         if req['unique_id'] not in student_installments and req['delete_state'] == 0:
-            stu = await Students.filter(unique_id=req['_student']['unique_id']).first()
-            install = await Installments.filter(unique_id=req['_installment']['unique_id']).first()
-            if stu is not None:
-                async with in_transaction() as conn:
-                    new = StudentInstallments(unique_id=req['unique_id'], sync_state=1, invoice=req['invoice'],
-                                              installment_id=install.id, student_id=stu.id, date=req['date'],
-                                              amount=req['amount'])
-                    await new.save(using_db=conn)
-        if req['unique_id'] in student_installments and req['delete_state'] == 0 and req['patch_state'] == 1:
-            stu = await Students.filter(unique_id=req['_student']['unique_id']).first()
-            install = await Installments.filter(unique_id=req['_installment']['unique_id']).first()
-            if stu is not None:
-                await StudentInstallments.filter(unique_id=req['unique_id']).update(sync_state=1,
-                                                                                    invoice=req['invoice'],
-                                                                                    installment_id=install.id,
-                                                                                    student_id=stu.id,
-                                                                                    date=req['date'],
-                                                                                    amount=req['amount'])
+            new.append(StudentInstallments(unique_id=req['unique_id'], **fields))
+        elif req['unique_id'] in student_installments and req['delete_state'] == 0 and req['patch_state'] == 1:
+            patched.append(StudentInstallments(id=student_installments[req['unique_id']], **fields))
+    async with in_transaction() as conn:
+        await delete_unique_ids(StudentInstallments, deleted, conn)
+        await StudentInstallments.bulk_create(new, using_db=conn)
+        if patched:
+            await StudentInstallments.bulk_update(patched, ['sync_state', 'invoice', 'student_id', 'date',
+                                                            'installment_id', 'amount'], IN_CHUNK_SIZE)
+    if deleted or new or patched:
+        touch('student_installments')
+    await save_watermark('student_installment', student_installments_mark)
+
+
+async def get_capabilities(client: httpx.AsyncClient) -> dict:
+    # e.g. {"batch": true, "max_batch_size": 500, "password_hashes": ["md5", "pbkdf2_sha256"]},
+    # {} from servers without /capabilities
+    req = await client.get(f'{HOST}/capabilities')
+    raise_server_error(req)
+    return req.json() if req.status_code == 200 else {}
+
+
+def get_batch_size(capabilities: dict) -> int:
+    # servers that take batches say so, 0 means one POST per row
+    if not capabilities.get('batch'):
+        return 0
+    return min(capabilities.get('max_batch_size', SYNC_BATCH_SIZE), SYNC_BATCH_SIZE)
 
 
+def raise_server_error(req: httpx.Response):
+    # a 5xx fails the sync, it is started again later; a 4xx is the server refusing that request
+    if req.status_code >= 500:
+        req.raise_for_status()
+
+
+async def push(client: httpx.AsyncClient, endpoint: str, items: list, batch_size: int, model=None) -> list:
+    # returns the unique_ids the server accepted, only those get marked as synced: here when the
+    # model is given, so what got through is kept when a server error ends the push. A batch
+    # answers per row, so any error status fails the sync; a single row the server refuses stays pending.
+    accepted = []
+    start = time.perf_counter()
+    try:
+        if batch_size:
+            for batch in chunks(items, batch_size):
+                req = await client.post(f'{HOST}/batch/{endpoint}', json={"items": batch})
+                req.raise_for_status()
+                accepted += [result['unique_id'] for result in req.json()['results'] if result['success']]
+        else:
+            for item in items:
+                req = await client.post(f'{HOST}/{endpoint}', json=item)
+                raise_server_error(req)
+                if req.status_code == 200:
+                    accepted.append(item['unique_id'])
+    finally:
+        count(status['phase'], endpoint, sent=len(items), accepted=len(accepted))
+        sync_step(status['phase'], endpoint, time.perf_counter() - start, len(accepted))
+        if model is not None:
+            await mark_synced(model, accepted)
+    return accepted
+
+
+async def mark_synced(model, unique_ids: list):
+    for chunk in chunks(unique_ids):
+        await model.filter(unique_id__in=chunk).update(sync_state=1)
+
+
+def student_installment_json(student_installment) -> dict:
+    return {"date": str(student_installment.date), "amount": student_installment.amount,
+            "unique_id": student_installment.unique_id,
+            "invoice": student_installment.invoice,
+            "install_unique_id": student_installment.installment.unique_id,
+            "student_unique_id": student_installment.student.unique_id}
+
+
+def set_phase(phase: str):
+    status['phase'] = phase
+    status['progress'].setdefault(phase, {})
+
+
+def count(phase: str, entity: str, **counters):
+    entity_counters = status['progress'].setdefault(phase, {}).setdefault(entity, {})
+    for key, n in counters.items():
+        entity_counters[key] = entity_counters.get(key, 0) + n
+
+
+# /del payload key and patch endpoint of each outbox entity
+DELETE_KEYS = {"student": "unique_id_students", "state": "unique_id_states",
+               "student_installment": "unique_id_students_install", "user": "unique_id_users"}
+PATCH_ENDPOINTS = {"student": "student", "state": "state", "student_installment": "student_installment",
+                   "user": "users"}
+
+
+async def patch_payloads(entity: str, unique_ids: list, pbkdf2: bool = False) -> list:
+    if entity == 'student':
+        students = await Students.filter(unique_id__in=unique_ids).prefetch_related('state', 'branch', 'governorate',
+                                                                                    'institute', 'poster')
+        return [dict(student_json(student), patch=True) for student in students]
+    if entity == 'state':
+        states = await States.filter(unique_id__in=unique_ids).values('name', 'unique_id')
+        return [dict(state, patch=True) for state in states]
+    if entity == 'student_installment':
+        student_installments = await StudentInstallments.filter(unique_id__in=unique_ids) \
+            .prefetch_related('student', 'installment')
+        return [dict(student_installment_json(insta), patch=True) for insta in student_installments]
+    users = []
+    for user in await Users.filter(unique_id__in=unique_ids):
+        auths = await UserAuth.filter(user_id=user.id).order_by('id').prefetch_related('state')
+        authority = [{"state_unique_id": auth.state.unique_id, "unique_id": auth.unique_id} for auth in auths]
+        users.append({"username": user.username, "password": pushed_password(user, pbkdf2), "authority": authority,
+                      "unique_id": user.unique_id})
+    return users
+
+
+async def push_outbox(client: httpx.AsyncClient, batch_size: int, pbkdf2: bool = False):
+    # drains the outbox in sequence order: per batch of entries one /del, one push per entity
+    # and one acknowledgement of what the server took, the rest stays pending for the next sync
+    after = 0
+    while True:
+        entries = await pending(after, IN_CHUNK_SIZE)
+        if not entries:
+            return
+        after = entries[-1]['id']
+        acknowledged = []
+        deletes = {key: [] for key in DELETE_KEYS.values()}
+        for entry in entries:
+            if entry['operation'] == DELETE:
+                deletes[DELETE_KEYS[entry['entity']]].append(entry['unique_id'])
+        try:
+            if any(deletes.values()):
+                set_phase('delete')
+                start = time.perf_counter()
+                req = await client.post(f'{HOST}/del', json=deletes)
+                raise_server_error(req)
+                for key, unique_ids in deletes.items():
+                    count('delete', key, sent=len(unique_ids))
+                sync_step('delete', 'del', time.perf_counter() - start,
+                          sum(map(len, deletes.values())) if req.status_code == 200 else 0)
+                if req.status_code == 200:
+                    acknowledged += [entry['id'] for entry in entries if entry['operation'] == DELETE]
+            set_phase('patch')
+            for entity, endpoint in PATCH_ENDPOINTS.items():
+                ids = {entry['unique_id']: entry['id'] for entry in entries
+                       if entry['entity'] == entity and entry['operation'] == PATCH}
+                if not ids:
+                    continue
+                payloads = await patch_payloads(entity, list(ids), pbkdf2)
+                accepted = await push(client, endpoint, payloads, batch_size)
+                # a record deleted since its patch has nothing left to push
+                gone = set(ids) - {payload['unique_id'] for payload in payloads}
+                acknowledged += [ids[unique_id] for unique_id in set(accepted) | gone]
+        finally:
+            # what the server took before an error is kept
+            await acknowledge(acknowledged)
+
+
+async def sync_once():
+    client = get_client()
+    set_phase('push')
+    capabilities = await get_capabilities(client)
+    batch_size = get_batch_size(capabilities)
+    installments = await Installments.filter(sync_state=0).values('name', 'unique_id')
+    await push(client, 'installments', installments, batch_size, Installments)
+    states = await States.filter(sync_state=0).values('name', 'unique_id')
+    await push(client, 'state', states, batch_size, States)
+    pbkdf2 = ALGORITHM in capabilities.get('password_hashes', [])
+    users = await get_users(pbkdf2)
+    await push(client, 'users', users, batch_size, Users)
+    students = await Students.filter(sync_state=0).prefetch_related('state', 'branch', 'governorate', 'institute',
+                                                                    'poster')
+    students = [student_json(student) for student in students]
+    await push(client, 'student', students, batch_size, Students)
+    student_installments = await StudentInstallments.filter(sync_state=0, student_id__isnull=False) \
+        .prefetch_related('student', 'installment')
+    student_installments = [student_installment_json(insta) for insta in student_installments]
+    await push(client, 'student_installment', student_installments, batch_size, StudentInstallments)
+    await push_outbox(client, batch_size, pbkdf2)
+    await get_all()
+
+
+async def run_sync():
+    start = time.perf_counter()
+    _pulls.clear()
+    try:
+        await sync_once()
+        status['state'] = 'done'
+    except Exception as e:
+        logging.getLogger(__name__).exception('sync failed')
+        status.update(state='failed', error=repr(e))
+    finally:
+        status.update(phase=None, finished_at=datetime.datetime.now().isoformat())
+        # still running here means the job was cancelled at shutdown
+        result = 'cancelled' if status['state'] == 'running' else status['state']
+        SYNC_SECONDS.observe((result,), time.perf_counter() - start)
+
+
+def start_sync() -> asyncio.Task:
+    # one sync at a time, starting while a sync runs joins the running one
+    global _job
+    if _job is None or _job.done():
+        status.update(state='running', phase=None, started_at=datetime.datetime.now().isoformat(),
+                      finished_at=None, error=None, progress={})
+        _job = asyncio.get_event_loop().create_task(run_sync())
+    return _job
+
+
+async def sync_periodically():
+    while True:
+        await asyncio.sleep(SYNC_INTERVAL)
+        await start_sync()
+
+
+async def start_scheduler():
+    global _scheduler
+    if SYNC_INTERVAL > 0:
+        _scheduler = asyncio.get_event_loop().create_task(sync_periodically())
+
+
+async def stop_sync():
+    for task in (_scheduler, _job):
+        if task is not None and not task.done():
+            task.cancel()
+
+
+# POST `/sync`
+#
+# - Starts pushing the local changes and pulling the remote ones in the background.
+# - Request Arguments: None
+# - Returns: the job status, a start while a sync is running returns the running one.
+#
+# Example Response `{
+#     "state": "running",
+#     "phase": null,
+#     "started_at": "2022-05-01T10:00:00",
+#     "finished_at": null,
+#     "error": null,
+#     "progress": {},
+#     "success": true
+# }`
+@sync_router.post('/sync', status_code=202)
+async def post_sync():
+    start_sync()
+    return dict(status, success=True)
+
+
+# GET `/sync/status`
+#
+# - Status of the running or last sync job.
+# - Request Arguments: None
+# - Returns: state (idle, running, done, failed), current phase (push, delete, patch, pull)
+#   and counters per phase and entity.
+#
+# Example Response `{
+#     "state": "running",
+#     "phase": "pull",
+#     "started_at": "2022-05-01T10:00:00",
+#     "finished_at": null,
+#     "error": null,
+#     "progress": {
+#         "push": {"student": {"sent": 120, "accepted": 120}},
+#         "pull": {"students": {"received": 35}}
+#     },
+#     "success": true
+# }`
+@sync_router.get('/sync/status')
+async def sync_status():
+    return dict(status, success=True)
+
+
+# GET `/sync`
+#
+# - Runs a sync and answers once it finished, joins the running one if there is one.
 @sync_router.get('/sync')
 async def sync():
-    installments = await Installments.filter(sync_state=0).all()
-    for install in installments:
-        req = requests.post(f"{HOST}/installments",
-                            json={"name": install.name, "unique_id": install.unique_id})
-        if req.status_code == 200:
-            await Installments.filter(id=install.id).update(sync_state=1)
-    states = await States.filter(sync_state=0).all()
-    for state in states:
-        req = requests.post(f"{HOST}/state", json={"name": state.name,
-                                                   "unique_id": state.unique_id})
-        if req.status_code == 200:
-            await States.filter(id=state.id).update(sync_state=1)
-    users = await get_users()
-    for user in users:
-        req = requests.post(f'{HOST}/users', json=user)
-        if req.status_code == 200:
-            await Users.filter(unique_id=user['unique_id']).update(sync_state=1)
-    students = await Students.filter(sync_state=0).all().prefetch_related('state', 'branch', 'governorate', 'institute',
-                                                                          'poster')
-    for student in students:
-        json_student = student_json(student)
-        req = requests.post(f'{HOST}/student', json=json_student)
-        if req.status_code == 200:
-            await Students.filter(unique_id=json_student['unique_id']).update(sync_state=1)
-    students = await Students.all().prefetch_related('state', 'branch', 'governorate', 'institute',
-                                                     'poster')
-    for student_install in students:
-        stu_install = await StudentInstallments.filter(student_id=student_install.id, sync_state=0).all(). \
-            prefetch_related(
-            'installment')
-        for insta in stu_install:
-            json_install = {"date": str(insta.date), "amount": insta.amount, "unique_id": insta.unique_id,
-                            "invoice": insta.invoice,
-                            "install_unique_id": insta.installment.unique_id,
-                            "student_unique_id": student_install.unique_id}
-            req = requests.post(
-                f'{HOST}/student_installment', json=json_install)
-            if req.status_code == 200:
-                await StudentInstallments.filter(id=insta.id).update(sync_state=1)
-    all_del = await get_del()
-    req = requests.post(f'{HOST}/del', json=all_del)
-    students_patch, states_patch, students_installment_patch, users_patch = await get_edits()
-    for student_patch in students_patch:
-        student_patch = await Students.filter(unique_id=student_patch).first().prefetch_related('state', 'branch',
-                                                                                                'governorate',
-                                                                                                'institute',
-                                                                                                'poster')
-        json_stu = student_json(student_patch)
-        json_stu['patch'] = True
-        req = requests.post(f'{HOST}/student', json=json_stu)
-        if req.status_code == 200:
-            await TemporaryPatch.filter(unique_id=json_stu['unique_id']).update(sync_state=1)
-    for state_patch in states_patch:
-        state_patch = await States.filter(unique_id=state_patch).first()
-        req = requests.post(f"{HOST}/state", json={"name": state_patch.name,
-                                                   "unique_id": state_patch.unique_id,
-                                                   "patch": True})
-        if req.status_code == 200:
-            await TemporaryPatch.filter(unique_id=state_patch.unique_id).update(sync_state=1)
-
-    for student_installment_patch in students_installment_patch:
-        install_patch = await StudentInstallments.filter(unique_id=student_installment_patch).first().prefetch_related(
-            'student', 'installment')
-        if install_patch:
-            data_patch = {"date": str(install_patch.date), "amount": install_patch.amount,
-                          "unique_id": install_patch.unique_id,
-                          "invoice": install_patch.invoice,
-                          "install_unique_id": install_patch.installment.unique_id,
-                          "student_unique_id": install_patch.student.unique_id, "patch": True}
-            req = requests.post(f'{HOST}/student_installment', json=data_patch)
-            if req.status_code == 200:
-                await TemporaryPatch.filter(unique_id=install_patch.unique_id).update(sync_state=1)
-    for user_auth in users_patch:
-        user = await Users.filter(unique_id=user_auth).first()
-        auths = await UserAuth.filter(user_id=user.id).all().prefetch_related('state')
-        authority = []
-        for auth in auths:
-            st = await States.filter(id=auth.state.id).first()
-            authority.append({"state_unique_id": st.unique_id,
-                              "unique_id": auth.unique_id})
-        user_json = {
-            "username": user.username, "password": user.password, "authority": authority, "unique_id": user.unique_id
-        }
-        req = requests.post(f'{HOST}/users', json=user_json)
-        if req.status_code == 200:
-            await TemporaryPatch.filter(unique_id=user.unique_id).update(sync_state=1)
-    await get_all()
-    return {
-        "success": True
-    }
+    # shielded: a client that gives up waiting doesn't cancel the sync
+    await asyncio.shield(start_sync())
+    return {"success": status['state'] == 'done'}
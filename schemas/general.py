@@ -49,6 +49,29 @@ class Student(BaseModel):
         orm_mode = True
 
 
+class StudentPatch(BaseModel):
+    # PATCH /students/{id}: only the fields sent are compared with the stored student and written
+    name: Optional[str] = None
+    school: Optional[str] = None
+    branch_id: Optional[int] = None
+    institute_id: Optional[int] = None
+    governorate_id: Optional[int] = None
+    first_phone: Optional[str] = None
+    second_phone: Optional[str] = None
+    poster_id: Optional[int] = None
+    code_1: Optional[str] = None
+    code_2: Optional[str] = None
+    telegram_username: Optional[str] = None
+    total_amount: Optional[float] = None
+    remaining_amount: Optional[float] = None
+    note: Optional[str] = None
+    installments: Optional[List[StudentInstall]] = None
+    state_id: Optional[int] = None
+
+    class Config:
+        orm_mode = True
+
+
 class Authority(BaseModel):
     id: int
 
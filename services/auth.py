@@ -0,0 +1,97 @@
+import hashlib
+import hmac
+import secrets
+
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from tortoise import Tortoise
+
+from models.models import UserAuth
+from services.cache import LRUCache
+from settings import PASSWORD_ITERATIONS, SESSION_MAX, SESSION_TTL, AUTHORITY_CACHE_SIZE
+
+# stored as pbkdf2_sha256$<iterations>$<salt>$<hex digest>, older versions stored a bare md5 hex digest
+ALGORITHM = "pbkdf2_sha256"
+
+# token -> {"user_id", "username", "name", "super"}
+sessions = LRUCache(SESSION_MAX, SESSION_TTL)
+# user id -> [{"name", "id"}] of the states the user may see
+authorities = LRUCache(AUTHORITY_CACHE_SIZE)
+
+
+def hash_password(password: str, iterations: int = PASSWORD_ITERATIONS) -> str:
+    salt = secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), iterations).hex()
+    return f'{ALGORITHM}${iterations}${salt}${digest}'
+
+
+def check_password(password: str, stored: str) -> bool:
+    if stored.startswith(f'{ALGORITHM}$'):
+        _, iterations, salt, digest = stored.split('$')
+        candidate = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), int(iterations)).hex()
+    else:
+        candidate, digest = hashlib.md5(password.encode()).hexdigest(), stored
+    return hmac.compare_digest(candidate, digest)
+
+
+def server_hash(password: str) -> str:
+    # The sync server and its other clients only verify md5 hex digests. Users are pushed with
+    # this one until the server lists pbkdf2_sha256 in its capabilities, the local login uses `password`.
+    return hashlib.md5(password.encode()).hexdigest()
+
+
+def needs_upgrade(stored: str) -> bool:
+    return not stored.startswith(f'{ALGORITHM}$') or int(stored.split('$')[1]) < PASSWORD_ITERATIONS
+
+
+# the hashing is slow on purpose, it runs in the thread pool to keep the event loop serving
+async def make_password(password: str) -> str:
+    return await run_in_threadpool(hash_password, password)
+
+
+async def verify_password(password: str, stored: str) -> bool:
+    return await run_in_threadpool(check_password, password, stored)
+
+
+async def ensure_server_password():
+    # startup hook: databases created before Users.server_password get the column
+    conn = Tortoise.get_connection('default')
+    _, columns = await conn.execute_query('PRAGMA table_info("users")')
+    if 'server_password' not in {column['name'] for column in columns}:
+        await conn.execute_script('ALTER TABLE "users" ADD "server_password" TEXT')
+
+
+async def get_authority(user_id: int) -> list:
+    states = authorities.get(user_id)
+    if states is None:
+        auth = await UserAuth.filter(user_id=user_id).order_by('id').prefetch_related('state')
+        states = [{"name": au.state.name, "id": au.state.id} for au in auth]
+        authorities.set(user_id, states)
+    return states
+
+
+def open_session(user) -> str:
+    token = secrets.token_urlsafe(32)
+    sessions.set(token, {"user_id": user.id, "username": user.username, "name": user.name, "super": user.super})
+    return token
+
+
+def close_sessions(user_id: int):
+    for token, session in sessions.items():
+        if session['user_id'] == user_id:
+            sessions.pop(token)
+
+
+def forget_user(user_id: int):
+    # the user was changed or deleted: drop the cached authority and the open sessions
+    authorities.pop(user_id)
+    close_sessions(user_id)
+
+
+async def current_session(request: Request) -> dict:
+    # dependency for routes that need a logged in user, the token goes in "Authorization: Bearer <token>"
+    token = request.headers.get('Authorization', '').replace('Bearer ', '', 1)
+    session = sessions.get(token)
+    if session is None:
+        raise HTTPException(status_code=401, detail="invalid or expired token")
+    return dict(session, authority=await get_authority(session['user_id']))
@@ -0,0 +1,40 @@
+import time
+from typing import Optional
+
+from fastapi import Request, Response
+
+# Per-table change counters, bumped by every write path (routes, sync pull).
+# Caches compare them to what they loaded and list endpoints turn them into
+# ETags. They live as long as the process, the epoch keeps a restarted
+# server from matching a tag handed out by the previous one.
+_EPOCH = format(time.time_ns(), 'x')
+_versions = {}
+
+# what a student row is built from
+STUDENT_TABLES = ("students", "student_installments", "installments", "branches", "governorates", "institutes",
+                  "posters", "states")
+
+
+def touch(*tables: str):
+    for table in tables:
+        _versions[table] = _versions.get(table, 0) + 1
+
+
+def version(table: str) -> int:
+    return _versions.get(table, 0)
+
+
+def etag(*tables: str, variant: str = '') -> str:
+    versions = '.'.join(str(version(table)) for table in tables)
+    return f'"{_EPOCH}-{versions}{"-" + variant if variant else ""}"'
+
+
+def not_modified(request: Request, tag: str) -> Optional[Response]:
+    # the 304 to answer when the client already holds this version
+    header = request.headers.get('if-none-match')
+    if header is None:
+        return None
+    tags = [value.strip().replace('W/', '', 1) for value in header.split(',')]
+    if '*' in tags or tag in tags:
+        return Response(status_code=304, headers={"ETag": tag})
+    return None
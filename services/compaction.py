@@ -0,0 +1,90 @@
+import asyncio
+import datetime
+import logging
+from typing import Optional
+
+from tortoise import Tortoise
+from tortoise.exceptions import OperationalError
+
+from models.models import Outbox, TemporaryDelete, TemporaryPatch
+from services.storage import chunks
+from settings import OUTBOX_RETENTION_DAYS, COMPACTION_INTERVAL
+
+_scheduler: Optional[asyncio.Task] = None
+
+
+async def outbox_ids(retention_days: float) -> set:
+    conn = Tortoise.get_connection('default')
+    # pending entries with a newer pending one for the same record
+    _, merged = await conn.execute_query(
+        'SELECT id FROM outbox WHERE sync_state = 0 AND id NOT IN '
+        '(SELECT MAX(id) FROM outbox WHERE sync_state = 0 GROUP BY unique_id)')
+    # acknowledged entries a newer entry of the same record supersedes
+    _, superseded = await conn.execute_query(
+        'SELECT id FROM outbox WHERE sync_state = 1 AND id NOT IN (SELECT MAX(id) FROM outbox GROUP BY unique_id)')
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=retention_days)
+    expired = await Outbox.filter(sync_state=1, synced_at__lt=cutoff).values_list('id', flat=True)
+    return {row['id'] for row in merged} | {row['id'] for row in superseded} | set(expired)
+
+
+async def table_bytes(table: str) -> Optional[int]:
+    # pages of the table and its indexes, None when sqlite is built without dbstat
+    conn = Tortoise.get_connection('default')
+    try:
+        _, rows = await conn.execute_query(
+            'SELECT SUM(pgsize) AS size FROM dbstat WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name = ?)',
+            [table])
+    except OperationalError:
+        return None
+    return rows[0]['size'] or 0
+
+
+async def compact(dry_run: bool = False, retention_days: float = OUTBOX_RETENTION_DAYS) -> dict:
+    # the legacy change log was moved into the outbox at startup, its acknowledged rows have no further use
+    candidates = [
+        (Outbox, await outbox_ids(retention_days)),
+        (TemporaryPatch, set(await TemporaryPatch.filter(sync_state=1).values_list('id', flat=True))),
+        (TemporaryDelete, set(await TemporaryDelete.filter(sync_state=1).values_list('id', flat=True))),
+    ]
+    tables = {}
+    for model, ids in candidates:
+        table = model._meta.db_table
+        before = await table_bytes(table)
+        total = await model.all().count()
+        if dry_run:
+            # share of the table the rows take up
+            size = None if before is None or not total else before * len(ids) // total
+        else:
+            for chunk in chunks(sorted(ids)):
+                await model.filter(id__in=chunk).delete()
+            after = await table_bytes(table)
+            size = None if before is None else before - after
+        tables[table] = {"rows": len(ids), "bytes": size}
+    return {
+        "dry_run": dry_run,
+        "retention_days": retention_days,
+        "tables": tables,
+        "rows": sum(t['rows'] for t in tables.values()),
+        "bytes": sum(t['bytes'] or 0 for t in tables.values()),
+    }
+
+
+async def compact_periodically():
+    while True:
+        await asyncio.sleep(COMPACTION_INTERVAL)
+        # a failed run (e.g. the database locked by a long sync) is retried at the next interval
+        try:
+            await compact()
+        except Exception:
+            logging.getLogger(__name__).exception('compaction failed')
+
+
+async def start_compaction():
+    global _scheduler
+    if COMPACTION_INTERVAL > 0:
+        _scheduler = asyncio.get_event_loop().create_task(compact_periodically())
+
+
+async def stop_compaction():
+    if _scheduler is not None and not _scheduler.done():
+        _scheduler.cancel()
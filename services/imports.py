@@ -0,0 +1,210 @@
+import codecs
+import csv
+import datetime
+import zipfile
+import zlib
+from xml.etree.ElementTree import ParseError
+from itertools import islice
+from typing import Iterator, Optional
+from uuid import uuid4
+
+import openpyxl
+from openpyxl.utils.exceptions import InvalidFileException
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from tortoise.transactions import in_transaction
+
+from models.models import Installments, Students, StudentInstallments
+from schemas.general import Student
+from services.changes import touch
+from services.lookups import lookup_maps
+from services.search import index_students
+from services.storage import chunks
+from settings import IMPORT_CHUNK_SIZE
+
+# Columns of an import file, the header row names them and any order works.
+# Student fields: name, school, first_phone, second_phone, code_1, code_2, telegram_username,
+# total_amount, remaining_amount, note and created_at (YYYY-MM-DD, today when empty).
+# state, branch, governorate, institute and poster take either the name or the id (state_id, ...).
+# Per installment, by its id: install_<id>_amount, install_<id>_invoice and install_<id>_date.
+LOOKUP_COLUMNS = {"state": "states", "branch": "branches", "governorate": "governorates",
+                  "institute": "institutes", "poster": "posters"}
+STUDENT_COLUMNS = ['name', 'school', 'first_phone', 'second_phone', 'code_1', 'code_2', 'telegram_username',
+                   'total_amount', 'remaining_amount', 'note']
+
+
+# what a file that is not valid UTF-8 CSV or a readable xlsx raises while it is read
+READ_ERRORS = (UnicodeDecodeError, csv.Error, zipfile.BadZipFile, zlib.error, ParseError, InvalidFileException)
+
+
+class UnsupportedFile(Exception):
+    pass
+
+
+class UnreadableFile(Exception):
+    # imported is the number of students saved before the file broke off
+    def __init__(self, message: str, imported: int = 0):
+        super().__init__(message)
+        self.imported = imported
+
+
+def cell(value) -> Optional[str]:
+    # spreadsheet cells come typed, the schema validates text
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.strftime('%Y-%m-%d')
+    value = str(value).strip()
+    return value or None
+
+
+def check_encoding(file):
+    # the whole upload is decoded once up front, so a cp1256 export is refused before any row is saved
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    try:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            decoder.decode(block)
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        raise UnreadableFile('the file is not UTF-8 text, save it as "CSV UTF-8"')
+    file.seek(0)
+
+
+def read_rows(file, filename: str) -> Iterator[tuple]:
+    # (line number, {column: value}) for each row after the header, read lazily from the upload
+    if filename.lower().endswith('.csv'):
+        check_encoding(file)
+        reader = csv.reader(codecs.iterdecode(file, 'utf-8-sig'))
+        rows = ((reader.line_num, row) for row in reader)
+    elif filename.lower().endswith('.xlsx'):
+        try:
+            sheet = openpyxl.load_workbook(file, read_only=True, data_only=True).active
+        except (KeyError, *READ_ERRORS) as exc:
+            # KeyError: a zip archive without the parts of a workbook
+            raise UnreadableFile(f'not a readable xlsx workbook: {exc}')
+        rows = enumerate(sheet.iter_rows(values_only=True), start=1)
+    else:
+        raise UnsupportedFile('upload a .csv or .xlsx file')
+    return with_header(rows)
+
+
+def with_header(rows) -> Iterator[tuple]:
+    header = None
+    for line, values in rows:
+        values = [cell(value) for value in values]
+        if header is None:
+            header = [(value or '').lower() for value in values]
+            continue
+        if any(values):
+            yield line, dict(zip(header, values))
+
+
+def by_name(names: dict) -> dict:
+    return {name.strip(): id_ for id_, name in names.items() if name}
+
+
+def resolve(row: dict, column: str, names: dict, ids: dict, errors: list) -> Optional[int]:
+    # the id of a state/branch/... given by name or by id
+    value = row.get(f'{column}_id') or row.get(column)
+    if value is None:
+        return None
+    if value.isdigit() and int(value) in ids:
+        return int(value)
+    if value in names:
+        return names[value]
+    errors.append(f'{column}: unknown {value!r}')
+
+
+def parse_date(value: Optional[str], column: str, errors: list) -> Optional[datetime.date]:
+    try:
+        return datetime.date.fromisoformat(value) if value else None
+    except ValueError:
+        errors.append(f'{column}: not a YYYY-MM-DD date {value!r}')
+
+
+def validate(row: dict, maps: dict, names: dict, install_ids: list, today: datetime.date) -> tuple:
+    # (Student schema, [created_at, installment dates...]) of a file row, or (None, [errors])
+    errors = []
+    data = {column: row.get(column) for column in STUDENT_COLUMNS}
+    for column, table in LOOKUP_COLUMNS.items():
+        data[f'{column}_id'] = resolve(row, column, names[table], maps[table], errors)
+    if row.get('state_id') is None and row.get('state') is None:
+        errors.append('state: field required')
+    # columns already reported above
+    reported = {error.split(':')[0] + '_id' for error in errors}
+    data['installments'] = [{"install_id": install_id, "amount": row.get(f'install_{install_id}_amount'),
+                             "invoice": row.get(f'install_{install_id}_invoice'),
+                             "date": row.get(f'install_{install_id}_date')} for install_id in install_ids]
+    # dates go to the models parsed, the installments default to created_at like the app's own form
+    created_at = parse_date(row.get('created_at'), 'created_at', errors) or today
+    dates = [created_at] + [parse_date(install['date'], f"install_{install['install_id']}_date", errors)
+                            or created_at for install in data['installments']]
+    try:
+        schema = Student(**data)
+    except ValidationError as exc:
+        errors += [f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in exc.errors()
+                   if error['loc'][0] not in reported]
+    if errors:
+        return None, errors
+    return schema, dates
+
+
+async def insert_students(valid: list) -> int:
+    # one transaction per chunk: bulk insert the students, read back their ids, then the installments
+    students = [Students(name=schema.name, school=schema.school, branch_id=schema.branch_id,
+                         governorate_id=schema.governorate_id, institute_id=schema.institute_id,
+                         state_id=schema.state_id, first_phone=schema.first_phone,
+                         second_phone=schema.second_phone, code_1=schema.code_1, code_2=schema.code_2,
+                         telegram_user=schema.telegram_username, created_at=dates[0], note=schema.note,
+                         total_amount=schema.total_amount, remaining_amount=schema.remaining_amount,
+                         poster_id=schema.poster_id or None, unique_id=str(uuid4()))
+                for schema, dates in valid]
+    async with in_transaction() as conn:
+        await Students.bulk_create(students, using_db=conn)
+        ids = {}
+        for chunk in chunks(student.unique_id for student in students):
+            ids.update(await Students.filter(unique_id__in=chunk).using_db(conn).values_list('unique_id', 'id'))
+        installments = [StudentInstallments(installment_id=install.install_id, date=date, amount=install.amount,
+                                            invoice=install.invoice, student_id=ids[student.unique_id],
+                                            unique_id=str(uuid4()))
+                        for student, (schema, dates) in zip(students, valid)
+                        for install, date in zip(schema.installments, dates[1:])]
+        await StudentInstallments.bulk_create(installments, using_db=conn)
+        await index_students(list(ids.values()), using_db=conn)
+    touch('students', 'student_installments')
+    return len(students)
+
+
+async def import_students(file, filename: str) -> dict:
+    # raises UnsupportedFile, or UnreadableFile, before anything is imported. A file that breaks off
+    # after its first chunks (a corrupt xlsx part, a malformed CSV line) raises UnreadableFile
+    # with the students already saved.
+    rows = await run_in_threadpool(read_rows, file, filename)
+    maps = await lookup_maps()
+    names = {table: by_name(table_names) for table, table_names in maps.items()}
+    install_ids = await Installments.all().order_by('id').values_list('id', flat=True)
+    today = datetime.date.today()
+    imported = 0
+    errors = []
+    # the last line read, set by the loop below
+    line = 0
+    while True:
+        # file parsing is blocking, it runs off the event loop one chunk at a time
+        try:
+            chunk = await run_in_threadpool(lambda: list(islice(rows, IMPORT_CHUNK_SIZE)))
+        except READ_ERRORS as exc:
+            raise UnreadableFile(f'the file could not be read after line {line}: {exc}', imported)
+        if not chunk:
+            break
+        valid = []
+        for line, row in chunk:
+            schema, result = validate(row, maps, names, install_ids, today)
+            if schema is None:
+                errors.append({"row": line, "errors": result})
+            else:
+                valid.append((schema, result))
+        if valid:
+            imported += await insert_students(valid)
+    return {"imported": imported, "failed": len(errors), "errors": errors}
@@ -0,0 +1,43 @@
+from fastapi.responses import JSONResponse, Response
+
+from models.models import Branches, Governorates, Institutes, Posters, States
+from services.changes import version
+
+# The small tables every student row points to. Their id -> name maps and the
+# bodies of their GET endpoints are kept in memory along with the change
+# counter they were loaded at, a write to the table (services.changes.touch)
+# makes them reload on next use.
+TABLES = {"branches": Branches, "governorates": Governorates, "institutes": Institutes, "posters": Posters,
+          "states": States}
+
+_maps = {}
+_bodies = {}
+
+
+async def lookup_map(table: str) -> dict:
+    cached = _maps.get(table)
+    if cached is not None and cached[0] == version(table):
+        return cached[1]
+    # a write racing with the load leaves the counter ahead of the stored one
+    loaded_at = version(table)
+    rows = dict(await TABLES[table].all().order_by('id').values_list('id', 'name'))
+    _maps[table] = (loaded_at, rows)
+    return rows
+
+
+async def lookup_maps() -> dict:
+    return {table: await lookup_map(table) for table in TABLES}
+
+
+async def cached_response(table: str, render) -> Response:
+    # render(id -> name map) builds the endpoint's JSON, serialized once per change of the table
+    cached = _bodies.get(table)
+    if cached is None or cached[0] != version(table):
+        loaded_at = version(table)
+        cached = (loaded_at, JSONResponse(render(await lookup_map(table))).body)
+        _bodies[table] = cached
+    return Response(content=cached[1], media_type='application/json')
+
+
+def id_names(names: dict) -> list:
+    return [{"id": id_, "name": name} for id_, name in names.items()]
@@ -0,0 +1,167 @@
+import bisect
+import time
+from contextvars import ContextVar
+
+# Request, database and sync metrics kept in process memory and served by GET /metrics in the
+# Prometheus text format. Recording is a dict lookup and a bisect per observation, no client
+# library involved.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SYNC_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# [statements, seconds] of the request being served, filled by the database connections
+_request_db = ContextVar('request_db', default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: tuple, values: tuple, le: str = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, help_: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, values: tuple = (), amount: float = 1):
+        self.series[values] = self.series.get(values, 0) + amount
+
+    def render(self) -> list:
+        return [f'{self.name}{_labels(self.labels, values)} {value}' for values, value in self.series.items()]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, values: tuple = (), amount: float = 1):
+        self.series[values] = self.series.get(values, 0) - amount
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_: str, labels: tuple, buckets: tuple):
+        self.name = name
+        self.help = help_
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [count per bucket..., count above the last bucket, sum]
+        self.series = {}
+
+    def observe(self, values: tuple, value: float):
+        series = self.series.get(values)
+        if series is None:
+            series = self.series[values] = [0] * (len(self.buckets) + 1) + [0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> list:
+        lines = []
+        for values, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(self.labels, values, bound)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, values)} {series[-1]}')
+            lines.append(f'{self.name}_count{_labels(self.labels, values)} {cumulative}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram('ims_http_request_duration_seconds',
+                            'Time from the request to the last byte of its response.',
+                            ('method', 'route', 'status'), LATENCY_BUCKETS)
+IN_FLIGHT = Gauge('ims_http_requests_in_flight', 'Requests being served.', ('method',))
+RESPONSE_BYTES = Histogram('ims_http_response_size_bytes', 'Response body bytes as sent, after compression.',
+                           ('method', 'route'), SIZE_BUCKETS)
+REQUEST_QUERIES = Histogram('ims_http_request_db_queries', 'SQL statements run to serve a request.',
+                            ('method', 'route'), QUERY_BUCKETS)
+REQUEST_DB_SECONDS = Histogram('ims_http_request_db_seconds', 'Time a request waited on the database.',
+                               ('method', 'route'), LATENCY_BUCKETS)
+SYNC_STEP_SECONDS = Histogram('ims_sync_step_duration_seconds',
+                              'Time of a sync step: pushing, patching or pulling one entity, or posting the deletes.',
+                              ('phase', 'entity'), SYNC_BUCKETS)
+SYNC_ROWS = Counter('ims_sync_rows_total', 'Rows a sync step pushed (accepted by the server) or pulled.',
+                    ('phase', 'entity'))
+SYNC_SECONDS = Histogram('ims_sync_duration_seconds', 'Time of a whole sync.', ('result',), SYNC_BUCKETS)
+METRICS = [REQUEST_SECONDS, IN_FLIGHT, RESPONSE_BYTES, REQUEST_QUERIES, REQUEST_DB_SECONDS, SYNC_STEP_SECONDS,
+           SYNC_ROWS, SYNC_SECONDS]
+
+
+def record_query(statement: bool, seconds: float):
+    # called by services.storage for every call on a database connection
+    stats = _request_db.get()
+    if stats is not None:
+        stats[0] += statement
+        stats[1] += seconds
+
+
+def sync_step(phase: str, entity: str, seconds: float, rows: int):
+    SYNC_STEP_SECONDS.observe((phase, entity), seconds)
+    SYNC_ROWS.inc((phase, entity), rows)
+
+
+def render() -> str:
+    lines = []
+    for metric in METRICS:
+        lines += [f'# HELP {metric.name} {metric.help}', f'# TYPE {metric.name} {metric.kind}']
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    # plain ASGI rather than BaseHTTPMiddleware: no extra task per request, and a streamed
+    # response is timed and measured up to its last byte
+    def __init__(self, app):
+        self.app = app
+        self.routes = None
+
+    def route(self, scope) -> str:
+        # the route template, not the path, so /students/1 and /students/2 are one series
+        if self.routes is None:
+            self.routes = {route.endpoint: route.path for route in scope['app'].routes
+                           if getattr(route, 'endpoint', None) is not None}
+        return self.routes.get(scope.get('endpoint'), 'unmatched')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        method = scope['method']
+        status = 500
+        size = 0
+        stats = [0, 0.0]
+
+        async def send_measured(message):
+            nonlocal status, size
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            await send(message)
+
+        token = _request_db.set(stats)
+        IN_FLIGHT.inc((method,))
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_measured)
+        finally:
+            elapsed = time.perf_counter() - start
+            IN_FLIGHT.dec((method,))
+            _request_db.reset(token)
+            route = self.route(scope)
+            REQUEST_SECONDS.observe((method, route, status), elapsed)
+            RESPONSE_BYTES.observe((method, route), size)
+            REQUEST_QUERIES.observe((method, route), stats[0])
+            REQUEST_DB_SECONDS.observe((method, route), stats[1])
@@ -0,0 +1,56 @@
+import datetime
+from typing import Optional
+
+from tortoise.transactions import in_transaction
+
+from models.models import Outbox, TemporaryDelete, TemporaryPatch
+from services.storage import chunks
+
+# Local changes waiting to be pushed, one pending entry per record: a newer
+# edit replaces the pending one and takes the next sequence, a delete
+# replaces a pending patch. Creates aren't logged, new rows carry sync_state=0.
+PATCH = "patch"
+DELETE = "delete"
+# TemporaryPatch/TemporaryDelete model_id
+LEGACY_ENTITIES = {1: "student", 2: "state", 3: "student_installment", 4: "user"}
+
+
+async def record(entity: str, operation: str, unique_ids: list, using_db=None):
+    if not unique_ids:
+        return
+    await discard(unique_ids, using_db)
+    await Outbox.bulk_create([Outbox(entity=entity, operation=operation, unique_id=unique_id)
+                              for unique_id in dict.fromkeys(unique_ids)], using_db=using_db)
+
+
+async def discard(unique_ids: list, using_db=None):
+    # drops pending entries, e.g. the patches of rows that went with a deleted student
+    for chunk in chunks(unique_ids):
+        await Outbox.filter(unique_id__in=chunk, sync_state=0).using_db(using_db).delete()
+
+
+async def pending(after: int = 0, limit: Optional[int] = None) -> list:
+    # the next pending entries in sequence order
+    query = Outbox.filter(sync_state=0, id__gt=after).order_by('id')
+    if limit:
+        query = query.limit(limit)
+    return await query.values('id', 'entity', 'operation', 'unique_id')
+
+
+async def acknowledge(ids: list):
+    for chunk in chunks(ids):
+        await Outbox.filter(id__in=chunk).update(sync_state=1, synced_at=datetime.datetime.now())
+
+
+async def import_legacy_changes():
+    # startup hook: moves what older versions left unsynced in TemporaryPatch/TemporaryDelete
+    patches = await TemporaryPatch.filter(sync_state=0).order_by('id').values('id', 'model_id', 'unique_id')
+    deletes = await TemporaryDelete.filter(sync_state=0).order_by('id').values('id', 'model_id', 'unique_id')
+    if not patches and not deletes:
+        return
+    async with in_transaction() as conn:
+        for rows, operation in ((patches, PATCH), (deletes, DELETE)):
+            for row in rows:
+                await record(LEGACY_ENTITIES[row['model_id']], operation, [row['unique_id']], conn)
+        await TemporaryPatch.filter(sync_state=0).using_db(conn).update(sync_state=1)
+        await TemporaryDelete.filter(sync_state=0).using_db(conn).update(sync_state=1)
@@ -0,0 +1,53 @@
+from uuid import uuid4
+
+from models.models import States, Users, UserAuth
+from services.storage import chunks
+
+# Authorities are (user_id, state_id) grants in UserAuth. The functions below take the grants a state
+# or a user should end up with, compare them with the stored ones in one query and apply only the
+# difference: one bulk delete, one bulk insert and one update of the users to push again, whatever
+# the number of users and states. Grants that stay keep their row and unique_id.
+
+
+async def super_user_ids(using_db=None) -> set:
+    return set(await Users.filter(super=1).using_db(using_db).values_list('id', flat=True))
+
+
+async def apply_grants(scope: dict, desired: set, using_db=None) -> set:
+    # scope filters UserAuth down to the rows desired replaces, e.g. {"state_id": 3};
+    # returns the ids of the users whose authority changed
+    stored = {}
+    duplicates = []
+    for id_, user_id, state_id in await UserAuth.filter(**scope).using_db(using_db).values_list(
+            'id', 'user_id', 'state_id'):
+        if (user_id, state_id) in stored:
+            # the same grant twice, left by older versions
+            duplicates.append(id_)
+        else:
+            stored[(user_id, state_id)] = id_
+    removed = [key for key in stored if key not in desired]
+    added = desired - stored.keys()
+    removed_ids = [stored[key] for key in removed] + duplicates
+    for chunk in chunks(removed_ids):
+        await UserAuth.filter(id__in=chunk).using_db(using_db).delete()
+    if added:
+        await UserAuth.bulk_create([UserAuth(user_id=user_id, state_id=state_id, unique_id=str(uuid4()))
+                                    for user_id, state_id in added], using_db=using_db)
+    changed = sorted({key[0] for key in removed} | {user_id for user_id, _ in added})
+    # the server takes a user's authorities along with the user
+    for chunk in chunks(changed):
+        await Users.filter(id__in=chunk).using_db(using_db).update(sync_state=0)
+    return set(changed)
+
+
+async def grant_state(state_id: int, user_ids, using_db=None) -> set:
+    # the users allowed on a state: the given ones, super users always
+    desired = {(user_id, state_id) for user_id in set(user_ids) | await super_user_ids(using_db)}
+    return await apply_grants({"state_id": state_id}, desired, using_db)
+
+
+async def grant_user(user_id: int, state_ids=None, using_db=None) -> set:
+    # the states a user is allowed on, state_ids=None for all of them
+    if state_ids is None:
+        state_ids = await States.all().using_db(using_db).values_list('id', flat=True)
+    return await apply_grants({"user_id": user_id}, {(user_id, state_id) for state_id in state_ids}, using_db)
@@ -0,0 +1,126 @@
+import datetime
+from typing import Optional
+
+from tortoise import Tortoise
+
+from models.models import Installments
+from services.cache import LRUCache
+from services.changes import version
+from services.lookups import lookup_maps
+from settings import REPORT_CACHE_SIZE
+
+# Office reports computed by GROUP BY queries over students and student_installments. A result is
+# cached along with the change counters of the tables it was computed from and served again until
+# one of them moves, so dashboards refreshing the same report don't rescan the installments.
+REPORT_TABLES = ("students", "student_installments", "installments", "states", "branches", "governorates",
+                 "institutes", "posters")
+# group_by -> (column, lookup table naming its ids)
+GROUPS = {
+    "day": ("si.date", None),
+    "installment": ("si.installment_id", None),
+    "state": ("s.state_id", "states"),
+    "branch": ("s.branch_id", "branches"),
+    "governorate": ("s.governorate_id", "governorates"),
+    "institute": ("s.institute_id", "institutes"),
+    "poster": ("s.poster_id", "posters"),
+}
+# a balance belongs to a student, not to a day or a payment
+OUTSTANDING_GROUPS = ("state", "branch", "governorate", "institute", "poster")
+
+_results = LRUCache(REPORT_CACHE_SIZE)
+
+
+class UnknownGroup(Exception):
+    pass
+
+
+def _versions() -> tuple:
+    return tuple(version(table) for table in REPORT_TABLES)
+
+
+async def _cached(key: tuple, compute) -> dict:
+    cached = _results.get(key)
+    if cached is not None and cached[0] == _versions():
+        return cached[1]
+    # a write racing with the query leaves the counters ahead of the stored ones
+    loaded_at = _versions()
+    result = await compute()
+    _results.set(key, (loaded_at, result))
+    return result
+
+
+async def _names(group: str) -> dict:
+    if group == "installment":
+        return dict(await Installments.all().values_list('id', 'name'))
+    table = GROUPS[group][1]
+    return (await lookup_maps())[table] if table else {}
+
+
+def _key_row(group: str, key, names: dict) -> dict:
+    if group == "day":
+        return {"date": key}
+    return {"id": key, "name": names.get(key)}
+
+
+async def collections(group: str, date_from: Optional[datetime.date] = None,
+                      date_to: Optional[datetime.date] = None, state_id: Optional[int] = None) -> dict:
+    # payments (installments with an amount) in the date range, per day/installment/state/branch/...
+    if group not in GROUPS:
+        raise UnknownGroup(f"group_by is one of {', '.join(GROUPS)}")
+
+    async def compute():
+        where = ["si.amount IS NOT NULL", "si.amount != 0"]
+        values = []
+        if date_from is not None:
+            where.append("si.date >= ?")
+            values.append(date_from.isoformat())
+        if date_to is not None:
+            where.append("si.date <= ?")
+            values.append(date_to.isoformat())
+        if state_id is not None:
+            where.append("s.state_id = ?")
+            values.append(state_id)
+        rows = await Tortoise.get_connection('default').execute_query_dict(
+            f"SELECT {GROUPS[group][0]} AS key, COUNT(*) AS payments, COUNT(DISTINCT si.student_id) AS students, "
+            f"SUM(si.amount) AS amount FROM student_installments si JOIN students s ON s.id = si.student_id "
+            f"WHERE {' AND '.join(where)} GROUP BY key ORDER BY key", values)
+        names = await _names(group)
+        return {"group_by": group, "date_from": date_from, "date_to": date_to, "state_id": state_id,
+                "rows": [{**_key_row(group, row['key'], names), "payments": row['payments'],
+                          "students": row['students'], "amount": row['amount']} for row in rows],
+                "payments": sum(row['payments'] for row in rows),
+                "amount": sum(row['amount'] for row in rows)}
+
+    return await _cached(("collections", group, date_from, date_to, state_id), compute)
+
+
+async def outstanding(group: str, as_of: Optional[datetime.date] = None, state_id: Optional[int] = None) -> dict:
+    # students whose payments up to as_of (all of them by default) fall short of their total_amount
+    if group not in OUTSTANDING_GROUPS:
+        raise UnknownGroup(f"group_by is one of {', '.join(OUTSTANDING_GROUPS)}")
+
+    async def compute():
+        paid_where = ["amount IS NOT NULL", "student_id IS NOT NULL"]
+        where = ["COALESCE(s.total_amount, 0) > COALESCE(p.paid, 0)"]
+        values = []
+        if as_of is not None:
+            paid_where.append("date <= ?")
+            where.append("(s.created_at IS NULL OR s.created_at <= ?)")
+            values += [as_of.isoformat(), as_of.isoformat()]
+        if state_id is not None:
+            where.append("s.state_id = ?")
+            values.append(state_id)
+        rows = await Tortoise.get_connection('default').execute_query_dict(
+            f"SELECT {GROUPS[group][0]} AS key, COUNT(*) AS students, "
+            f"SUM(s.total_amount - COALESCE(p.paid, 0)) AS outstanding FROM students s "
+            f"LEFT JOIN (SELECT student_id, SUM(amount) AS paid FROM student_installments "
+            f"WHERE {' AND '.join(paid_where)} GROUP BY student_id) p ON p.student_id = s.id "
+            f"WHERE {' AND '.join(where)} GROUP BY key ORDER BY key", values)
+        names = await _names(group)
+        return {"group_by": group, "as_of": as_of, "state_id": state_id,
+                "rows": [{**_key_row(group, row['key'], names), "students": row['students'],
+                          "outstanding": row['outstanding']} for row in rows],
+                "students": sum(row['students'] for row in rows),
+                "outstanding": sum(row['outstanding'] for row in rows)}
+
+    return await _cached(("outstanding", group, as_of, state_id), compute)
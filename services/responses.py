@@ -0,0 +1,29 @@
+import json
+from typing import Optional
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from settings import FAST_JSON
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson takes the student dicts with their dates as they are, no jsonable_encoder pass
+FAST = FAST_JSON and orjson is not None
+JSON_RESPONSE = ORJSONResponse if FAST else JSONResponse
+
+
+def json_response(content, headers: Optional[dict] = None) -> JSONResponse:
+    # for the big payloads of plain dicts, lists and dates
+    if FAST:
+        return ORJSONResponse(content, headers=headers)
+    return JSONResponse(jsonable_encoder(content), headers=headers)
+
+
+def json_line(obj) -> bytes:
+    if FAST:
+        return orjson.dumps(obj) + b'\n'
+    return (json.dumps(obj, ensure_ascii=False, default=str) + '\n').encode()
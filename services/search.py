@@ -0,0 +1,123 @@
+import re
+from typing import Optional
+
+from tortoise import Tortoise
+from tortoise.exceptions import OperationalError
+
+from models.models import Students
+from services.storage import chunks
+
+# Full text index over the searchable student columns, rowid = students.id.
+# Text is normalized in python before it is written or queried, so the
+# Arabic spelling variants below all land on the same tokens.
+FTS_TABLE = "students_fts"
+FTS_SCHEMA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS "{FTS_TABLE}" USING fts5(
+    name, school, phones, codes, telegram_user, state_id UNINDEXED,
+    tokenize = "unicode61 remove_diacritics 2", prefix = '1 2 3'
+);
+"""
+# name matches count the most when ranking, then school, phones, codes, telegram
+RANK = f'bm25("{FTS_TABLE}", 10.0, 2.0, 1.0, 1.0, 1.0)'
+
+# harakat, quranic marks and the tatweel
+_ARABIC_MARKS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_ARABIC_LETTERS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ة': 'ه',
+    'ى': 'ي',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+})
+_NON_WORD = re.compile(r'[^\w]+')
+
+available = False
+
+
+def normalize(text: Optional[str]) -> str:
+    if not text:
+        return ''
+    return _ARABIC_MARKS.sub('', text).translate(_ARABIC_LETTERS).lower()
+
+
+def match_expression(text: str) -> Optional[str]:
+    # every word of the query must match the start of a token: '"word"*' AND ...
+    words = [w for w in _NON_WORD.split(normalize(text)) if w]
+    if not words:
+        return None
+    return ' '.join(f'"{w}"*' for w in words)
+
+
+def _row(student: dict) -> list:
+    return [student['id'], normalize(student['name']), normalize(student['school']),
+            normalize(' '.join(p for p in (student['first_phone'], student['second_phone']) if p)),
+            normalize(' '.join(c for c in (student['code_1'], student['code_2']) if c)),
+            normalize(student['telegram_user']), student['state_id']]
+
+
+async def index_students(student_ids: list, using_db=None):
+    # (re)writes the index rows of the given students, pass the transaction connection when inside one
+    if not available or not student_ids:
+        return
+    conn = using_db or Tortoise.get_connection('default')
+    for chunk in chunks(student_ids):
+        students = await Students.filter(id__in=chunk).using_db(conn).values(
+            'id', 'name', 'school', 'first_phone', 'second_phone', 'code_1', 'code_2', 'telegram_user', 'state_id')
+        await conn.execute_query(f'DELETE FROM "{FTS_TABLE}" WHERE rowid IN ({",".join("?" * len(chunk))})', chunk)
+        if students:
+            await conn.execute_many(
+                f'INSERT INTO "{FTS_TABLE}" (rowid, name, school, phones, codes, telegram_user, state_id) '
+                f'VALUES (?, ?, ?, ?, ?, ?, ?)', [_row(student) for student in students])
+
+
+async def unindex_students(student_ids: list, using_db=None):
+    if not available or not student_ids:
+        return
+    conn = using_db or Tortoise.get_connection('default')
+    for chunk in chunks(student_ids):
+        await conn.execute_query(f'DELETE FROM "{FTS_TABLE}" WHERE rowid IN ({",".join("?" * len(chunk))})', chunk)
+
+
+async def prune_index(using_db=None):
+    # drops index rows whose student is gone, e.g. removed by a state delete cascade
+    if not available:
+        return
+    conn = using_db or Tortoise.get_connection('default')
+    await conn.execute_query(f'DELETE FROM "{FTS_TABLE}" WHERE rowid NOT IN (SELECT id FROM students)')
+
+
+async def rebuild_index():
+    ids = await Students.all().order_by('id').values_list('id', flat=True)
+    conn = Tortoise.get_connection('default')
+    await conn.execute_query(f'DELETE FROM "{FTS_TABLE}"')
+    await index_students(ids)
+
+
+async def search_students(state_id, text: str, limit: int, offset: int = 0) -> Optional[tuple]:
+    # returns (total matches, ranked student ids of the page), or None when the index can't answer
+    expression = match_expression(text) if available else None
+    if expression is None:
+        return None
+    conn = Tortoise.get_connection('default')
+    where = f'"{FTS_TABLE}" MATCH ? AND state_id = ?'
+    _, count = await conn.execute_query(f'SELECT count(*) AS total FROM "{FTS_TABLE}" WHERE {where}',
+                                        [expression, int(state_id)])
+    _, rows = await conn.execute_query(f'SELECT rowid FROM "{FTS_TABLE}" WHERE {where} ORDER BY {RANK}, rowid '
+                                       f'LIMIT ? OFFSET ?', [expression, int(state_id), limit, offset])
+    return count[0]['total'], [row['rowid'] for row in rows]
+
+
+async def ensure_search_index():
+    # startup hook: creates the index and rebuilds it when it drifted from the students table
+    global available
+    conn = Tortoise.get_connection('default')
+    try:
+        await conn.execute_script(FTS_SCHEMA)
+    except OperationalError:
+        # sqlite built without FTS5, searches keep using LIKE
+        available = False
+        return
+    available = True
+    _, indexed = await conn.execute_query(f'SELECT count(*) AS total FROM "{FTS_TABLE}"')
+    if indexed[0]['total'] != await Students.all().count():
+        await rebuild_index()
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from collections import deque
+from typing import Iterator
+
+import aiosqlite
+from tortoise import Tortoise
+from tortoise.backends.sqlite.client import SqliteClient, translate_exceptions
+from tortoise.exceptions import IntegrityError
+from tortoise.transactions import in_transaction
+
+from services.metrics import record_query
+from settings import DB_PATH, DB_PROFILE, DB_READERS, DB_CACHE_SIZE, DB_MMAP_SIZE, DB_BUSY_TIMEOUT, METRICS
+
+# SQLite caps the number of bound parameters per statement, long id lists go in chunks of this size.
+IN_CHUNK_SIZE = 500
+
+# pragmas of every connection, by IMS_DB_PROFILE
+PROFILES = {
+    "default": {},
+    "tuned": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -DB_CACHE_SIZE,
+        "mmap_size": DB_MMAP_SIZE,
+        "temp_store": "MEMORY",
+        "busy_timeout": DB_BUSY_TIMEOUT,
+    },
+}
+
+
+def db_config(path: str = DB_PATH, profile: str = DB_PROFILE, readers: int = DB_READERS) -> dict:
+    # tortoise connection config, the engine is this module: the default profile is the ORM's own
+    # single connection, only metered
+    if profile == "default":
+        return {"engine": "services.storage", "credentials": {"file_path": path, "readers": 0}}
+    return {"engine": "services.storage",
+            "credentials": {"file_path": path, "readers": readers, **PROFILES[profile]}}
+
+
+# aiosqlite functions that run a statement, the rest fetch rows or close cursors
+STATEMENTS = {"execute", "executemany", "executescript", "_execute_fetchall", "_execute_insert"}
+
+
+class MeteredConnection(aiosqlite.Connection):
+    # every database call passes through _execute: counts the statements and the time spent
+    # waiting on the connection's thread towards the request being served
+    async def _execute(self, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super()._execute(fn, *args, **kwargs)
+        finally:
+            record_query(fn.__name__ in STATEMENTS, time.perf_counter() - start)
+
+
+def connect(path: str) -> aiosqlite.Connection:
+    # aiosqlite.connect, with the metered connection when IMS_METRICS is on
+    connection_class = MeteredConnection if METRICS else aiosqlite.Connection
+    return connection_class(lambda: sqlite3.connect(path, isolation_level=None), 64)
+
+
+# Indexes the models can't declare, tortoise has neither unique TextFields nor partial indexes:
+# the unique_id indexes the models declare on these tables are made UNIQUE, and the rows waiting
+# to be pushed get a partial index per table.
+UNIQUE_INDEXES = {"idx_installment_unique__9331ef": "installments", "idx_states_unique__3babbc": "states",
+                  "idx_users_unique__adf56d": "users", "idx_user_auth_unique__c0a614": "user_auth"}
+UNSYNCED_TABLES = ["installments", "states", "users", "students", "student_installments", "temporarydelete",
+                   "temporarypatch"]
+
+
+async def ensure_indexes():
+    # startup hook, after generate_schemas created the models' own indexes
+    conn = Tortoise.get_connection('default')
+    for table in UNSYNCED_TABLES:
+        await conn.execute_query(
+            f'CREATE INDEX IF NOT EXISTS "idx_{table}_unsynced" ON "{table}" ("id") WHERE "sync_state" = 0')
+    _, rows = await conn.execute_query("SELECT name, sql FROM sqlite_master WHERE type = 'index'")
+    existing = {row['name']: row['sql'] or '' for row in rows}
+    for name, table in UNIQUE_INDEXES.items():
+        if existing.get(name, '').startswith('CREATE UNIQUE'):
+            continue
+        try:
+            async with in_transaction() as tx:
+                await tx.execute_query(f'DROP INDEX IF EXISTS "{name}"')
+                await tx.execute_query(f'CREATE UNIQUE INDEX "{name}" ON "{table}" ("unique_id")')
+        except IntegrityError:
+            # rolled back to the plain index, the duplicates predate this version
+            logging.getLogger(__name__).warning('%s has duplicate unique_ids, its unique_id index stays plain', table)
+
+
+def chunks(items, size: int = IN_CHUNK_SIZE) -> Iterator[list]:
+    # consecutive slices of at most size items, e.g. for filter(id__in=chunk)
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class ReadWriteSqliteClient(SqliteClient):
+    # One writer connection takes every write and every transaction, serialized by the ORM's
+    # lock as before. SELECTs outside a transaction go to a pool of query_only reader
+    # connections, in WAL mode they read the last commit while the writer is busy.
+    # Each aiosqlite connection runs on its own thread, so the readers also run in parallel.
+    def __init__(self, file_path: str, readers: int = 0, **kwargs):
+        super().__init__(file_path, **kwargs)
+        self.readers = int(readers)
+        self._readers = []
+        self._idle = []
+        self._waiters = deque()
+
+    async def create_connection(self, with_db: bool) -> None:
+        if not self._connection:
+            # SqliteClient.create_connection, on a connection of ours
+            self._connection = connect(self.filename)
+            self._connection.start()
+            await self._connection._connect()
+            self._connection._conn.row_factory = sqlite3.Row
+            for pragma, val in self.pragmas.items():
+                await (await self._connection.execute(f"PRAGMA {pragma}={val}")).close()
+        if not self._readers and self.readers:
+            for _ in range(self.readers):
+                connection = connect(self.filename)
+                connection.start()
+                await connection._connect()
+                connection._conn.row_factory = sqlite3.Row
+                for pragma, val in self.pragmas.items():
+                    if pragma != "journal_mode":
+                        await (await connection.execute(f"PRAGMA {pragma}={val}")).close()
+                await (await connection.execute("PRAGMA query_only=1")).close()
+                self._readers.append(connection)
+            self._idle = list(self._readers)
+
+    async def close(self) -> None:
+        for connection in self._readers:
+            await connection.close()
+        self._readers = []
+        self._idle = []
+        await super().close()
+
+    def _reads(self, query: str) -> bool:
+        return bool(self._readers) and query.lstrip()[:6].upper() == "SELECT"
+
+    async def _acquire_reader(self) -> aiosqlite.Connection:
+        if self._idle:
+            return self._idle.pop()
+        # first come first served, a released reader goes straight to the oldest waiter
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release_reader(waiter.result())
+            raise
+
+    def _release_reader(self, connection: aiosqlite.Connection):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(connection)
+                return
+        self._idle.append(connection)
+
+    async def _read(self, query: str, values):
+        connection = await self._acquire_reader()
+        try:
+            self.log.debug("%s: %s", query, values)
+            return await connection.execute_fetchall(query, values)
+        finally:
+            self._release_reader(connection)
+
+    @translate_exceptions
+    async def execute_query(self, query: str, values=None):
+        if not self._reads(query):
+            return await SqliteClient.execute_query.__wrapped__(self, query, values)
+        rows = await self._read(query.replace("\x00", "'||CHAR(0)||'"), values)
+        return len(rows), rows
+
+    @translate_exceptions
+    async def execute_query_dict(self, query: str, values=None):
+        if not self._reads(query):
+            return await SqliteClient.execute_query_dict.__wrapped__(self, query, values)
+        return list(map(dict, await self._read(query.replace("\x00", "'||CHAR(0)||'"), values)))
+
+
+client_class = ReadWriteSqliteClient
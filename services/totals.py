@@ -0,0 +1,210 @@
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+
+from models.models import Installments, InstallmentTotals, StateTotals, Students, StudentTotals
+from services.lookups import lookup_map
+
+# Paid to date per student and collected/outstanding per state and installment round.
+# SQLite triggers apply every installment and student write to the totals as a delta, in the
+# writing statement's transaction, so local edits, imports, sync pulls and delete cascades
+# all keep them current. When a student is deleted its BEFORE DELETE trigger takes the whole
+# student out while its installments still exist, the cascaded installment deletes find no
+# student afterwards and change nothing.
+
+# the student's share of each round, by installment_id
+_STUDENT_ROUNDS = """
+    SELECT installment_id, SUM(amount) AS paid, COUNT(*) AS payments FROM student_installments
+    WHERE student_id = {student}.id AND installment_id IS NOT NULL AND COALESCE(amount, 0) != 0
+    GROUP BY installment_id
+"""
+_STUDENT_PAID = "COALESCE((SELECT paid FROM student_totals WHERE student_id = {student}.id), 0)"
+
+
+def _add_payment(row: str) -> str:
+    return f"""
+    INSERT INTO student_totals (student_id, paid) SELECT {row}.student_id, {row}.amount
+        WHERE {row}.student_id IS NOT NULL
+        ON CONFLICT (student_id) DO UPDATE SET paid = paid + excluded.paid;
+    UPDATE state_totals SET paid = paid + {row}.amount
+        WHERE state_id = (SELECT state_id FROM students WHERE id = {row}.student_id);
+    INSERT INTO installment_totals (state_id, installment_id, paid, payments)
+        SELECT state_id, {row}.installment_id, {row}.amount, 1 FROM students
+        WHERE id = {row}.student_id AND state_id IS NOT NULL AND {row}.installment_id IS NOT NULL
+        ON CONFLICT (state_id, installment_id) DO UPDATE SET paid = paid + excluded.paid, payments = payments + 1;
+"""
+
+
+def _remove_payment(row: str) -> str:
+    return f"""
+    UPDATE student_totals SET paid = paid - {row}.amount WHERE student_id = {row}.student_id;
+    UPDATE state_totals SET paid = paid - {row}.amount
+        WHERE state_id = (SELECT state_id FROM students WHERE id = {row}.student_id);
+    UPDATE installment_totals SET paid = paid - {row}.amount, payments = payments - 1
+        WHERE installment_id = {row}.installment_id
+        AND state_id = (SELECT state_id FROM students WHERE id = {row}.student_id);
+"""
+
+
+def _add_student(row: str) -> str:
+    return f"""
+    INSERT INTO state_totals (state_id, students, total_amount, paid)
+        SELECT {row}.state_id, 1, COALESCE({row}.total_amount, 0), {_STUDENT_PAID.format(student=row)}
+        WHERE {row}.state_id IS NOT NULL
+        ON CONFLICT (state_id) DO UPDATE SET students = students + 1,
+            total_amount = total_amount + excluded.total_amount, paid = paid + excluded.paid;
+"""
+
+
+def _remove_student(row: str) -> str:
+    return f"""
+    UPDATE state_totals SET students = students - 1, total_amount = total_amount - COALESCE({row}.total_amount, 0),
+        paid = paid - {_STUDENT_PAID.format(student=row)}
+        WHERE state_id = {row}.state_id;
+"""
+
+
+def _add_rounds(row: str) -> str:
+    return f"""
+    INSERT INTO installment_totals (state_id, installment_id, paid, payments)
+        SELECT {row}.state_id, installment_id, paid, payments FROM ({_STUDENT_ROUNDS.format(student=row)})
+        WHERE {row}.state_id IS NOT NULL
+        ON CONFLICT (state_id, installment_id) DO UPDATE SET paid = paid + excluded.paid,
+            payments = payments + excluded.payments;
+"""
+
+
+def _remove_rounds(row: str) -> str:
+    return f"""
+    UPDATE installment_totals SET
+        paid = paid - (SELECT COALESCE(SUM(amount), 0) FROM student_installments
+                       WHERE student_id = {row}.id AND installment_id = installment_totals.installment_id),
+        payments = payments - (SELECT COUNT(*) FROM student_installments
+                               WHERE student_id = {row}.id AND installment_id = installment_totals.installment_id
+                               AND COALESCE(amount, 0) != 0)
+        WHERE state_id = {row}.state_id
+        AND installment_id IN (SELECT installment_id FROM student_installments WHERE student_id = {row}.id);
+"""
+
+
+TRIGGERS = {
+    "totals_installment_insert": f"""
+CREATE TRIGGER IF NOT EXISTS "totals_installment_insert" AFTER INSERT ON "student_installments"
+WHEN COALESCE(NEW.amount, 0) != 0
+BEGIN {_add_payment('NEW')} END;
+""",
+    "totals_installment_delete": f"""
+CREATE TRIGGER IF NOT EXISTS "totals_installment_delete" AFTER DELETE ON "student_installments"
+WHEN COALESCE(OLD.amount, 0) != 0
+BEGIN {_remove_payment('OLD')} END;
+""",
+    # split in two so each half only runs for a row that had, or now has, an amount
+    "totals_installment_update_old": f"""
+CREATE TRIGGER IF NOT EXISTS "totals_installment_update_old" AFTER UPDATE OF amount, student_id, installment_id
+ON "student_installments"
+WHEN COALESCE(OLD.amount, 0) != 0 AND (OLD.amount IS NOT NEW.amount OR OLD.student_id IS NOT NEW.student_id
+                                       OR OLD.installment_id IS NOT NEW.installment_id)
+BEGIN {_remove_payment('OLD')} END;
+""",
+    "totals_installment_update_new": f"""
+CREATE TRIGGER IF NOT EXISTS "totals_installment_update_new" AFTER UPDATE OF amount, student_id, installment_id
+ON "student_installments"
+WHEN COALESCE(NEW.amount, 0) != 0 AND (OLD.amount IS NOT NEW.amount OR OLD.student_id IS NOT NEW.student_id
+                                       OR OLD.installment_id IS NOT NEW.installment_id)
+BEGIN {_add_payment('NEW')} END;
+""",
+    "totals_student_insert": f"""
+CREATE TRIGGER IF NOT EXISTS "totals_student_insert" AFTER INSERT ON "students"
+BEGIN {_add_student('NEW')} END;
+""",
+    "totals_student_update": f"""
+CREATE TRIGGER IF NOT EXISTS "totals_student_update" AFTER UPDATE OF state_id, total_amount ON "students"
+WHEN OLD.state_id IS NOT NEW.state_id OR OLD.total_amount IS NOT NEW.total_amount
+BEGIN {_remove_student('OLD')} {_add_student('NEW')} END;
+""",
+    "totals_student_move": f"""
+CREATE TRIGGER IF NOT EXISTS "totals_student_move" AFTER UPDATE OF state_id ON "students"
+WHEN OLD.state_id IS NOT NEW.state_id
+BEGIN {_remove_rounds('OLD')} {_add_rounds('NEW')} END;
+""",
+    "totals_student_delete": f"""
+CREATE TRIGGER IF NOT EXISTS "totals_student_delete" BEFORE DELETE ON "students"
+BEGIN {_remove_rounds('OLD')} {_remove_student('OLD')} END;
+""",
+}
+
+
+REBUILD = [
+    "DELETE FROM student_totals",
+    "DELETE FROM state_totals",
+    "DELETE FROM installment_totals",
+    """INSERT INTO student_totals (student_id, paid)
+    SELECT student_id, SUM(amount) FROM student_installments
+    WHERE student_id IS NOT NULL AND COALESCE(amount, 0) != 0 GROUP BY student_id""",
+    """INSERT INTO state_totals (state_id, students, total_amount, paid)
+    SELECT s.state_id, COUNT(*), SUM(COALESCE(s.total_amount, 0)), SUM(COALESCE(t.paid, 0))
+    FROM students s LEFT JOIN student_totals t ON t.student_id = s.id
+    WHERE s.state_id IS NOT NULL GROUP BY s.state_id""",
+    """INSERT INTO installment_totals (state_id, installment_id, paid, payments)
+    SELECT s.state_id, si.installment_id, SUM(si.amount), COUNT(*)
+    FROM student_installments si JOIN students s ON s.id = si.student_id
+    WHERE s.state_id IS NOT NULL AND si.installment_id IS NOT NULL AND COALESCE(si.amount, 0) != 0
+    GROUP BY s.state_id, si.installment_id""",
+]
+
+
+async def rebuild_totals():
+    # recomputes every total from the rows, one statement each (executescript would commit midway)
+    async with in_transaction() as conn:
+        for sql in REBUILD:
+            await conn.execute_query(sql)
+
+
+async def ensure_totals():
+    # startup hook: creates the triggers, and fills the totals when they were missing
+    conn = Tortoise.get_connection('default')
+    _, rows = await conn.execute_query(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'totals_%'")
+    if {row['name'] for row in rows} == set(TRIGGERS):
+        return
+    async with in_transaction() as conn:
+        for sql in TRIGGERS.values():
+            await conn.execute_query(sql)
+    await rebuild_totals()
+
+
+def _outstanding(row: dict) -> dict:
+    row['outstanding'] = row['total_amount'] - row['paid']
+    return row
+
+
+async def summary(state_id=None) -> dict:
+    # reads only the totals tables, so it costs the same for any number of students
+    names = dict(await Installments.all().values_list('id', 'name'))
+    states = StateTotals.all()
+    # rounds a state no longer has a payment in keep a zero row
+    rounds = InstallmentTotals.filter(payments__gt=0)
+    if state_id is not None:
+        states = states.filter(state_id=state_id)
+        rounds = rounds.filter(state_id=state_id)
+    by_state = {}
+    for row in await rounds.order_by('installment_id').values('state_id', 'installment_id', 'paid', 'payments'):
+        by_state.setdefault(row['state_id'], []).append({"id": row['installment_id'],
+                                                         "name": names.get(row['installment_id']),
+                                                         "paid": row['paid'], "payments": row['payments']})
+    state_names = await lookup_map('states')
+    result = []
+    for row in await states.order_by('state_id').values('state_id', 'students', 'total_amount', 'paid'):
+        result.append(_outstanding({"id": row['state_id'], "name": state_names.get(row['state_id']),
+                                    "students": row['students'], "total_amount": row['total_amount'],
+                                    "paid": row['paid'], "installments": by_state.get(row['state_id'], [])}))
+    return {"states": result}
+
+
+async def student_summary(student_id: int):
+    student = await Students.filter(id=student_id).first().values('id', 'name', 'total_amount', 'remaining_amount')
+    if student is None:
+        return None
+    totals = await StudentTotals.filter(student_id=student_id).first().values('paid')
+    student['total_amount'] = student['total_amount'] or 0
+    student['paid'] = totals['paid'] if totals else 0
+    return _outstanding(student)
@@ -0,0 +1,43 @@
+import os
+
+# The remote sync server, e.g. IMS_SYNC_HOST=http://127.0.0.1:8801 for benchmarks/sync_server.py.
+SYNC_HOST = os.environ.get('IMS_SYNC_HOST', 'http://65.20.73.107')
+# Sync HTTP client, values in seconds; override through the environment.
+SYNC_CONNECT_TIMEOUT = float(os.environ.get('IMS_SYNC_CONNECT_TIMEOUT', 5))
+SYNC_TIMEOUT = float(os.environ.get('IMS_SYNC_TIMEOUT', 60))
+SYNC_MAX_CONNECTIONS = int(os.environ.get('IMS_SYNC_MAX_CONNECTIONS', 10))
+SYNC_KEEPALIVE_EXPIRY = float(os.environ.get('IMS_SYNC_KEEPALIVE_EXPIRY', 30))
+# Upper bound of rows per batch POST when the sync server supports batches.
+SYNC_BATCH_SIZE = int(os.environ.get('IMS_SYNC_BATCH_SIZE', 500))
+# Seconds between background syncs, 0 leaves syncing to POST /sync.
+SYNC_INTERVAL = float(os.environ.get('IMS_SYNC_INTERVAL', 0))
+# Acknowledged outbox entries are kept this many days, compaction runs every IMS_COMPACTION_INTERVAL
+# seconds, 0 leaves it to POST /admin/compact.
+OUTBOX_RETENTION_DAYS = float(os.environ.get('IMS_OUTBOX_RETENTION_DAYS', 30))
+COMPACTION_INTERVAL = float(os.environ.get('IMS_COMPACTION_INTERVAL', 24 * 60 * 60))
+# PBKDF2-SHA256 rounds for stored passwords, older hashes are upgraded on the next login.
+PASSWORD_ITERATIONS = int(os.environ.get('IMS_PASSWORD_ITERATIONS', 260000))
+# Login sessions kept in memory: how many and for how many seconds.
+SESSION_MAX = int(os.environ.get('IMS_SESSION_MAX', 1000))
+SESSION_TTL = float(os.environ.get('IMS_SESSION_TTL', 12 * 60 * 60))
+# Users whose authority states are kept in memory.
+AUTHORITY_CACHE_SIZE = int(os.environ.get('IMS_AUTHORITY_CACHE_SIZE', 256))
+# IMS_FAST_JSON=1 serializes responses with orjson when it is installed.
+FAST_JSON = os.environ.get('IMS_FAST_JSON', '0') == '1'
+# Responses of at least this many bytes are gzipped for clients that accept it.
+GZIP_MIN_SIZE = int(os.environ.get('IMS_GZIP_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.environ.get('IMS_GZIP_LEVEL', 6))
+# SQLite storage: IMS_DB_PROFILE=tuned applies the pragmas below and reads outside transactions go to
+# IMS_DB_READERS reader connections, =default keeps one connection with the ORM's own settings.
+DB_PATH = os.environ.get('IMS_DB_PATH', 'db.sqlite3')
+DB_PROFILE = os.environ.get('IMS_DB_PROFILE', 'tuned')
+DB_READERS = int(os.environ.get('IMS_DB_READERS', 4))
+DB_CACHE_SIZE = int(os.environ.get('IMS_DB_CACHE_SIZE', 64 * 1024))  # KiB per connection
+DB_MMAP_SIZE = int(os.environ.get('IMS_DB_MMAP_SIZE', 256 * 1024 * 1024))  # bytes
+DB_BUSY_TIMEOUT = int(os.environ.get('IMS_DB_BUSY_TIMEOUT', 5000))  # ms
+# Rows of an uploaded student file inserted per transaction.
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMS_IMPORT_CHUNK_SIZE', 1000))
+# Report results kept in memory, each until a write to the tables it reads.
+REPORT_CACHE_SIZE = int(os.environ.get('IMS_REPORT_CACHE_SIZE', 64))
+# IMS_METRICS=0 turns off the request, database and sync metrics served at GET /metrics.
+METRICS = os.environ.get('IMS_METRICS', '1') != '0'
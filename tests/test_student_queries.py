@@ -0,0 +1,86 @@
+"""
+The student listings must run the same number of SQL statements however many students there
+are: the installments are batch-loaded, not fetched per student.
+"""
+import asyncio
+import logging
+import os
+import tempfile
+from uuid import uuid4
+
+import httpx
+from fastapi import FastAPI
+from tortoise import Tortoise
+
+from models.models import Branches, Governorates, Installments, Institutes, Posters, States, Students, \
+    StudentInstallments
+from routes.general import general_router
+
+URLS = {"GET /students": '/students',
+        "GET /states/{id}/students": '/states/{state_id}/students?page=1&number_of_students=50'}
+
+
+class StatementCounter(logging.Handler):
+    # the sqlite client logs every statement it runs at debug level
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+async def add_students(students: int) -> int:
+    # `students` students in one state, each with a row per installment; returns the state id
+    lookups = {}
+    for model in (Branches, Governorates, Institutes, Posters):
+        lookups[model] = await model.create(name=model.__name__)
+    state = await States.create(name='state', unique_id=str(uuid4()))
+    installments = [await Installments.create(name=f'installment {n}', unique_id=str(uuid4())) for n in range(4)]
+    await Students.bulk_create([Students(name=f'student {n}', state_id=state.id, branch_id=lookups[Branches].id,
+                                         governorate_id=lookups[Governorates].id,
+                                         institute_id=lookups[Institutes].id, poster_id=lookups[Posters].id,
+                                         unique_id=str(uuid4())) for n in range(students)])
+    await StudentInstallments.bulk_create([
+        StudentInstallments(student_id=student_id, installment_id=installment.id, amount=250, unique_id=str(uuid4()))
+        for student_id in await Students.all().values_list('id', flat=True) for installment in installments])
+    return state.id
+
+
+async def count_statements(students: int) -> dict:
+    # endpoint -> statements run by one request, on a fresh database with `students` students
+    path = os.path.join(tempfile.mkdtemp(), 'test.sqlite3')
+    await Tortoise.init(db_url=f'sqlite://{path}', modules={'models': ['models.models']})
+    await Tortoise.generate_schemas()
+    app = FastAPI()
+    app.include_router(general_router)
+    logger = logging.getLogger('tortoise.db_client')
+    counter = StatementCounter()
+    level = logger.level
+    counts = {}
+    try:
+        state_id = await add_students(students)
+        async with httpx.AsyncClient(app=app, base_url='http://test') as client:
+            for name, url in URLS.items():
+                url = url.format(state_id=state_id)
+                # the first request may also fill in-memory caches
+                assert (await client.get(url)).status_code == 200
+                logger.addHandler(counter)
+                logger.setLevel(logging.DEBUG)
+                counter.count = 0
+                try:
+                    assert (await client.get(url)).status_code == 200
+                finally:
+                    logger.removeHandler(counter)
+                    logger.setLevel(level)
+                counts[name] = counter.count
+    finally:
+        await Tortoise.close_connections()
+    return counts
+
+
+def test_student_listings_run_constant_queries():
+    small = asyncio.run(count_statements(100))
+    large = asyncio.run(count_statements(200))
+    assert all(small.values())
+    assert small == large